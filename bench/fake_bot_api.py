@@ -0,0 +1,104 @@
+"""
+Локальная замена Bot API для нагрузочных тестов.
+Отвечает на методы, которые использует бот, с настраиваемой задержкой и считает вызовы.
+"""
+import asyncio
+import itertools
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {
+    "id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+    "can_join_groups": True, "can_read_all_group_messages": True, "supports_inline_queries": False,
+}
+
+
+class FakeBotApi:
+    def __init__(self, host="127.0.0.1", port=8081, latency=0.02, member_count=0, audio=b""):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.member_count = member_count
+        self.audio = audio
+        self.calls = Counter()
+        self.last_call = time.monotonic()
+        self._message_ids = itertools.count(1_000_000)
+        # Последнее отправленное ботом сообщение в каждом чате (для нажатий на его кнопки)
+        self.last_message_id = {}
+        self._runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        return f"http://{self.host}:{self.port}/file/bot"
+
+    def reset(self) -> None:
+        self.calls.clear()
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/file/bot{token}/{path:.*}", self._download)
+        app.router.add_post("/bot{token}/{method}", self._method)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _params(self, request) -> dict:
+        if not request.can_read_body:
+            return {}
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    def _message(self, chat_id, text=None) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "supergroup", "title": "Bench"},
+            "from": BOT_USER,
+            "text": text or "",
+        }
+
+    async def _method(self, request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+        self.last_call = time.monotonic()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(params.get("chat_id", 0), params.get("text"))
+            if method == "sendMessage":
+                self.last_message_id[int(result["chat"]["id"])] = result["message_id"]
+        elif method == "getChatMember":
+            user_id = int(params["user_id"])
+            result = {"status": "member", "user": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}}
+        elif method == "getChatMemberCount":
+            result = self.member_count
+        elif method == "getFile":
+            file_id = params["file_id"]
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.audio),
+                      "file_path": f"voice/{file_id}.ogg"}
+        elif method == "getUpdates":
+            await asyncio.sleep(1)
+            result = []
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _download(self, request) -> web.Response:
+        self.calls["downloadFile"] += 1
+        self.last_call = time.monotonic()
+        return web.Response(body=self.audio, content_type="audio/ogg")
@@ -0,0 +1,333 @@
+"""
+Нагрузочный бенчмарк бота на локальной замене Bot API.
+
+Бот из bot/main.py запускается в режиме вебхука, обновления приходят HTTP-запросами
+(как от Telegram), а все ответы уходят в bench/fake_bot_api.py. Результат — JSON
+с пропускной способностью, p50/p99 времени обработчиков и памятью по каждому сценарию,
+который удобно сравнивать между коммитами.
+
+Пример:
+    python bench/run_bench.py --output bench_output.json
+    python bench/run_bench.py --scenario text_flood --messages 20000
+    python bench/run_bench.py --scenario replay --replay updates.jsonl
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "bot"), os.path.join(ROOT, "tools"), os.path.dirname(os.path.abspath(__file__))]
+
+from fake_bot_api import FakeBotApi  # noqa: E402
+from post_update import make_callback_update, make_text_update, make_voice_update, post_updates  # noqa: E402
+
+SCENARIOS = ("text_flood", "voice_burst", "tag_all", "replay")
+WEBHOOK_SECRET = "bench-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, q) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as file:
+        pages = int(file.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+# Короткий OGG/Opus для голосовых сценариев (нужен ffmpeg)
+def make_audio(seconds) -> bytes:
+    if not shutil.which("ffmpeg"):
+        return b""
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi",
+         "-i", f"sine=frequency=300:duration={seconds}", "-c:a", "libopus", "-f", "ogg", "pipe:1"],
+        capture_output=True,
+    )
+    return result.stdout if result.returncode == 0 else b""
+
+
+def install_bench_engine(delay) -> None:
+    import stt
+
+    class BenchEngine(stt.RecognizerEngine):
+        """Имитация распознавания: фиксированная задержка CPU/сети и постоянный текст."""
+
+        name = "bench"
+
+        def transcribe(self, pcm, language):
+            time.sleep(delay)
+            return "тестовый текст"
+
+    stt.ENGINES[BenchEngine.name] = BenchEngine
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.api = FakeBotApi(port=free_port(), latency=args.api_latency_ms / 1000,
+                              member_count=args.tag_members + 1, audio=make_audio(args.voice_seconds))
+        self.webhook_port = free_port()
+        self.samples = []
+        self.main = None
+        self.app = None
+        self._stop = None
+        self._task = None
+
+    @property
+    def webhook_url(self) -> str:
+        return f"http://127.0.0.1:{self.webhook_port}/telegram"
+
+    async def start(self) -> None:
+        await self.api.start()
+        os.environ.update({
+            "TELEGRAM_TOKEN": "1:bench",
+            "RUN_MODE": "webhook",
+            "WEBHOOK_LISTEN": "127.0.0.1",
+            "WEBHOOK_PORT": str(self.webhook_port),
+            "WEBHOOK_SECRET": WEBHOOK_SECRET,
+            "STT_ENGINE": "bench",
+            "TAG_ALL_INTERVAL": "0",
+            "RATE_LIMITS": "0",
+            "OUTBOUND_RATE": "100000",
+            "ROSTER_SYNC_INTERVAL": "0",
+        })
+        install_bench_engine(self.args.stt_delay_ms / 1000)
+
+        import_start = time.perf_counter()
+        import main
+        import metrics
+        self.import_seconds = time.perf_counter() - import_start
+        self.main = main
+        metrics.latency_observers.append(lambda name, duration: self.samples.append((name, duration)))
+
+        self.app = main.build_application(base_url=self.api.base_url, base_file_url=self.api.base_file_url)
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(main.run_bot(self.app, self._stop))
+        await self._wait_port()
+        # Даты в Bot API — целые секунды: обновления из той же секунды, что и старт, бот сочтёт накопившимися
+        await asyncio.sleep(1.1)
+
+    async def stop(self) -> None:
+        self._stop.set()
+        await self._task
+        await self.api.stop()
+
+    async def _wait_port(self, timeout=30.0) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.webhook_port)
+                writer.close()
+                return
+            except OSError:
+                if self._task.done():
+                    self._task.result()
+                await asyncio.sleep(0.05)
+        raise RuntimeError("Вебхук бота не поднялся")
+
+    # Ждём, пока бот всё обработает: очередь пуста и к Bot API давно не обращались
+    # Тишина отсчитывается и от момента отправки пачки: обработчик мог ещё не успеть обратиться к API
+    async def wait_idle(self, quiet=0.5, timeout=900.0, since=0.0) -> None:
+        queue = self.main.transcription_queue
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            idle = (
+                self.app.update_queue.empty()
+                and queue.depth == 0 and queue.busy == 0
+                and self.main.outbox.depth == 0
+                and time.monotonic() - max(self.api.last_call, since) >= quiet
+            )
+            if idle:
+                return
+            await asyncio.sleep(0.05)
+        raise RuntimeError("Бот не закончил обработку за отведённое время")
+
+    async def run(self, name, batches) -> dict:
+        self.samples.clear()
+        self.api.reset()
+        rss_before = rss_mb()
+        count = 0
+        start = time.perf_counter()
+        for updates in batches:
+            # Пачка может зависеть от ответов бота на предыдущие (например, id сообщения с кнопками)
+            if callable(updates):
+                updates = updates()
+            count += len(updates)
+            statuses = await post_updates(self.webhook_url, updates, secret=WEBHOOK_SECRET,
+                                          concurrency=self.args.concurrency)
+            rejected = sum(status != 200 for status in statuses)
+            if rejected:
+                raise RuntimeError(f"{name}: вебхук отклонил {rejected} обновлений")
+            await self.wait_idle(since=time.monotonic())
+        duration = time.perf_counter() - start - 0.5 * len(batches)
+
+        by_handler = {}
+        for handler, value in self.samples:
+            by_handler.setdefault(handler, []).append(value)
+        latencies = [value for _, value in self.samples]
+        return {
+            "updates": count,
+            "duration_s": round(duration, 3),
+            "throughput_ups": round(count / duration, 1) if duration > 0 else None,
+            "latency_ms": self._latency(latencies),
+            "handlers": {handler: self._latency(values) for handler, values in sorted(by_handler.items())},
+            "api_calls": dict(sorted(self.api.calls.items())),
+            "rss_mb": round(rss_mb(), 1),
+            "rss_delta_mb": round(rss_mb() - rss_before, 1),
+        }
+
+    @staticmethod
+    def _latency(values) -> dict:
+        return {
+            "count": len(values),
+            "p50": round(percentile(values, 0.5) * 1000, 2),
+            "p99": round(percentile(values, 0.99) * 1000, 2),
+            "max": round(max(values) * 1000, 2) if values else 0.0,
+        }
+
+
+def text_flood(args):
+    rng = random.Random(1)
+    texts = ["привет", "как дела", "кто играет в майнкрафт?", "ок", "/roll 1-6", "/eball"]
+    updates = []
+    for _ in range(args.messages):
+        chat_id = -1000 - rng.randrange(args.chats)
+        user_id = rng.randrange(1, args.users + 1)
+        updates.append(make_text_update(rng.choice(texts), chat_id=chat_id, user_id=user_id,
+                                        first_name=f"User{user_id}"))
+    return [updates]
+
+
+def voice_burst(args):
+    return [[
+        make_voice_update(f"bench-voice-{index}", chat_id=-2000, user_id=index % 50 + 1,
+                          duration=args.voice_seconds)
+        for index in range(args.voices)
+    ]]
+
+
+def tag_all(bench, args):
+    chat_id = -5000
+    for user_id in range(1, args.tag_members + 1):
+        bench.main.chat_data.add(str(chat_id), user_id, f"User{user_id}")
+    return [
+        [make_text_update("/tag_all", chat_id=chat_id, user_id=1)],
+        lambda: [make_callback_update("confirm_tag", message_id=bench.api.last_message_id[chat_id],
+                                      chat_id=chat_id, user_id=1)],
+    ]
+
+
+# Записанные обновления (JSONL, по одному обновлению Bot API в строке); даты сдвигаются на «сейчас»
+def replay(args):
+    now = int(time.time())
+    updates = []
+    with open(args.replay, encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            update = json.loads(line)
+            for key in ("message", "edited_message"):
+                if key in update:
+                    update[key]["date"] = now
+            updates.append(update)
+    return [updates]
+
+
+async def run_all(args) -> dict:
+    bench = Bench(args)
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.chdir(workdir)
+    await bench.start()
+    results = {}
+    try:
+        for scenario in args.scenario:
+            if scenario == "text_flood":
+                results[scenario] = await bench.run(scenario, text_flood(args))
+            elif scenario == "voice_burst":
+                if not bench.api.audio:
+                    results[scenario] = {"skipped": "ffmpeg не найден"}
+                    continue
+                results[scenario] = await bench.run(scenario, voice_burst(args))
+            elif scenario == "tag_all":
+                results[scenario] = await bench.run(scenario, tag_all(bench, args))
+            elif scenario == "replay":
+                if not args.replay:
+                    continue
+                results[scenario] = await bench.run(scenario, replay(args))
+    finally:
+        await bench.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "started_at": int(time.time()),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "import_s": round(bench.import_seconds, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "scenarios": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="Сценарий (можно несколько раз); по умолчанию все")
+    parser.add_argument("--messages", type=int, default=5000, help="text_flood: число сообщений")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--voices", type=int, default=50, help="voice_burst: число голосовых")
+    parser.add_argument("--voice-seconds", type=int, default=5)
+    parser.add_argument("--stt-delay-ms", type=float, default=200, help="Имитируемое время распознавания")
+    parser.add_argument("--tag-members", type=int, default=5000, help="tag_all: участников в чате")
+    parser.add_argument("--replay", help="replay: JSONL-файл с обновлениями")
+    parser.add_argument("--api-latency-ms", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=20, help="Параллельных HTTP-запросов к вебхуку")
+    parser.add_argument("--output", help="Куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+    args.scenario = args.scenario or list(SCENARIOS)
+    output = os.path.abspath(args.output) if args.output else None
+
+    result = asyncio.run(run_all(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
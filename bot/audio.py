@@ -0,0 +1,196 @@
+import struct
+import subprocess
+import tempfile
+
+import numpy as np
+
+# Формат PCM, который получает распознаватель: 16 кГц, моно, 16 бит
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+
+class DecodeError(Exception):
+    """ffmpeg не смог декодировать аудио."""
+
+
+class AudioTooLong(Exception):
+    """Аудио длиннее допустимого (после обрезки тишины)."""
+
+    def __init__(self, seconds, limit):
+        super().__init__(f"{seconds:.0f} с при ограничении {limit:.0f} с")
+        self.seconds = seconds
+        self.limit = limit
+
+
+class AudioBuffer(tempfile.SpooledTemporaryFile):
+    """Буфер скачанного файла: в памяти до max_size байт, дальше — временный файл (on_disk)."""
+
+    on_disk = False
+
+    def rollover(self):
+        super().rollover()
+        self.on_disk = True
+
+
+# Скачивание файла Telegram в память. Буфер сам переходит на диск, если файл больше limit байт
+async def download_audio(file, limit):
+    buffer = AudioBuffer(max_size=limit)
+    try:
+        await file.download_to_memory(out=buffer)
+    except BaseException:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer
+
+
+# ffmpeg только распаковывает кодек: WAV с исходными частотой и числом каналов,
+# остальное (моно, частота движка, тишина) делает preprocess() над массивом отсчётов.
+# Байты идут в канал; файл на диске — через stdin, но открывается как файл (/dev/stdin):
+# протокол pipe: никогда не перематывает вход, даже если stdin — обычный файл
+def _run_ffmpeg(source) -> bytes:
+    command = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0" if isinstance(source, bytes) else "file:/dev/stdin",
+        "-vn", "-f", "wav", "-acodec", "pcm_s16le",
+        "pipe:1",
+    ]
+    if isinstance(source, bytes):
+        result = subprocess.run(command, input=source, capture_output=True)
+    else:
+        result = subprocess.run(command, stdin=source, capture_output=True)
+    if result.returncode != 0 or not result.stdout:
+        raise DecodeError(result.stderr.decode(errors="replace").strip() or "пустой результат")
+    return result.stdout
+
+
+# Разбор WAV из канала ffmpeg: размеры в заголовке могут быть не заполнены, поэтому данными
+# считается всё после заголовка чанка data. Возвращает отсчёты формы (кадры, каналы) и частоту
+def parse_wav(data):
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise DecodeError("ffmpeg вернул не WAV")
+    offset = 12
+    channels = sample_rate = None
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack_from("<4sI", data, offset)
+        offset += 8
+        if chunk_id == b"fmt ":
+            _, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", data, offset)
+            if bits != 16:
+                raise DecodeError(f"Неожиданная разрядность WAV: {bits}")
+        elif chunk_id == b"data":
+            if channels is None:
+                break
+            payload = data[offset:]
+            payload = payload[:len(payload) - len(payload) % (SAMPLE_WIDTH * channels)]
+            return np.frombuffer(payload, dtype="<i2").reshape(-1, channels), sample_rate
+        offset += size + (size & 1)
+    raise DecodeError("В WAV нет заголовка fmt или данных")
+
+
+# MP4, у которого индекс (moov) записан после данных (mdat): ffmpeg не прочитает его из канала,
+# ему нужно перематывать вход. Смотрим только заголовки коробок верхнего уровня
+def needs_seek(data) -> bool:
+    if data[4:8] != b"ftyp":
+        return False
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box = struct.unpack_from(">I4s", data, offset)
+        if box == b"moov":
+            return False
+        if box == b"mdat":
+            return True
+        if size == 1:
+            if offset + 16 > len(data):
+                break
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+        if size < 8:
+            break
+        offset += size
+    return True
+
+
+# Декодирование OGG/MP4 через каналы ffmpeg (без промежуточных файлов)
+def decode_audio(buffer):
+    buffer.seek(0)
+    if not getattr(buffer, "on_disk", False):
+        data = buffer.read()
+        if not needs_seek(data):
+            return parse_wav(_run_ffmpeg(data))
+        # Индекс MP4 в конце файла — переносим буфер на диск, чтобы ffmpeg мог перематывать
+        buffer.rollover()
+        buffer.seek(0)
+    # Файл на диске — ffmpeg открывает его заново по дескриптору и может перематывать
+    return parse_wav(_run_ffmpeg(buffer))
+
+
+# Смена частоты дискретизации. При понижении сначала ФНЧ (sinc с окном Ханна)
+# ниже новой частоты Найквиста, иначе высокие частоты «заворачиваются» в речевую полосу
+def resample(samples, rate, target_rate, taps=32):
+    if rate == target_rate or not len(samples):
+        return samples
+    if target_rate < rate:
+        n = np.arange(-taps, taps + 1)
+        kernel = np.sinc(n * target_rate / rate) * np.hanning(len(n))
+        samples = np.convolve(samples, (kernel / kernel.sum()).astype(np.float32), mode="same")
+        if rate % target_rate == 0:
+            return samples[::rate // target_rate]
+    count = int(len(samples) * target_rate / rate)
+    positions = np.arange(count) * (rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+# Обрезка тишины в начале и в конце: кадры громче threshold_db (дБ от полной шкалы)
+# считаются речью, вокруг крайних из них остаётся pad_ms запаса
+def trim_silence(samples, sample_rate, threshold_db=-45.0, frame_ms=20, pad_ms=200):
+    frame = sample_rate * frame_ms // 1000
+    frames_count = len(samples) // frame
+    if frames_count == 0:
+        return samples
+    frames = samples[:frames_count * frame].reshape(frames_count, frame)
+    energy = np.sqrt(np.mean(frames * frames, axis=1))
+    loud = np.flatnonzero(energy > 32768 * 10 ** (threshold_db / 20))
+    if not len(loud):
+        return samples[:0]
+    pad = pad_ms // frame_ms
+    start = max(loud[0] - pad, 0) * frame
+    end = len(samples) if loud[-1] + 1 + pad >= frames_count else (loud[-1] + 1 + pad) * frame
+    return samples[start:end]
+
+
+# Подготовка к распознаванию: моно, частота движка, без тишины по краям.
+# max_seconds — ограничение длины после обрезки (None — без ограничения)
+def preprocess(samples, sample_rate, target_rate=SAMPLE_RATE, silence_db=-45.0, max_seconds=None):
+    mono = samples.mean(axis=1, dtype=np.float32) if samples.ndim == 2 else samples.astype(np.float32)
+    mono = resample(mono, sample_rate, target_rate)
+    mono = trim_silence(mono, target_rate, threshold_db=silence_db)
+    seconds = len(mono) / target_rate
+    if max_seconds is not None and seconds > max_seconds:
+        raise AudioTooLong(seconds, max_seconds)
+    return np.clip(np.rint(mono), -32768, 32767).astype(np.int16)
+
+
+# Нарезка длинного PCM (массив int16) на фрагменты по паузам, фрагменты — байты для движка.
+# Фрагмент набирается до chunk_seconds и режется в самом тихом кадре окна поиска;
+# если пауз нет, режем жёстко на max_seconds.
+def split_on_silence(samples, sample_rate=SAMPLE_RATE, chunk_seconds=25.0, max_seconds=40.0, frame_ms=20):
+    frame = sample_rate * frame_ms // 1000
+    frames_count = len(samples) // frame
+    if len(samples) <= int(max_seconds * sample_rate) or frames_count == 0:
+        return [samples.tobytes()] if len(samples) else []
+
+    # Энергия каждого кадра считается одной векторной операцией
+    frames = samples[:frames_count * frame].astype(np.float32).reshape(frames_count, frame)
+    energy = np.sqrt(np.mean(frames * frames, axis=1))
+
+    target = int(chunk_seconds * 1000 / frame_ms)
+    limit = int(max_seconds * 1000 / frame_ms)
+    chunks = []
+    start = 0
+    while frames_count - start > limit:
+        window = energy[start + target:start + limit]
+        cut = start + target + int(np.argmin(window))
+        chunks.append(samples[start * frame:cut * frame].tobytes())
+        start = cut
+    chunks.append(samples[start * frame:].tobytes())
+    return chunks
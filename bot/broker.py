@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from sender import EDITS, INTERACTIVE
+
+# Исходящие сообщения обработчиков, которые отправляет основной процесс
+OUTBOUND = "outbound"
+
+
+class JobBroker:
+    """
+    Очередь задач в SQLite для распределения тяжёлой работы между процессами.
+    Приёмник обновлений ставит задачи (enqueue), обработчики из других процессов забирают их (claim).
+    Забранная задача «арендуется» на lease секунд: если процесс упал и не отчитался,
+    по истечении аренды задачу заберёт другой обработчик (не больше max_attempts попыток).
+    Пока задача выполняется, обработчик продлевает аренду (heartbeat). Владелец задачи —
+    пара (worker, attempts) из claim(): heartbeat, complete и release с ними действуют, только
+    если задачу с тех пор не забрал кто-то другой.
+    Все методы блокирующие — из цикла событий их вызывают через asyncio.to_thread.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            lease_until REAL,
+            created REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+    """
+
+    def __init__(self, path, lease=300.0, max_attempts=3):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    # Ставит задачу в очередь; возвращает число задач того же вида, ожидающих перед ней
+    def enqueue(self, kind, payload) -> int:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (kind, payload, created) VALUES (?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            return self._conn.execute(
+                "SELECT COUNT(*) - 1 FROM jobs WHERE status = 'queued' AND kind = ?", (kind,)
+            ).fetchone()[0]
+
+    # Забирает самую старую задачу (или задачу с истёкшей арендой); None — очередь пуста
+    def claim(self, worker, kinds=None):
+        now = time.time()
+        kind_filter = ""
+        params = [now]
+        if kinds:
+            kind_filter = f"AND kind IN ({','.join('?' * len(kinds))})"
+            params.extend(kinds)
+        with self._lock:
+            row = self._conn.execute(
+                f"""
+                UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE (status = 'queued' OR (status = 'running' AND lease_until < ?)) {kind_filter}
+                    ORDER BY id LIMIT 1
+                )
+                RETURNING id, kind, payload, attempts
+                """,
+                [worker, now + self.lease, *params],
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, kind, payload, attempts = row
+        return {"id": job_id, "kind": kind, "payload": json.loads(payload), "attempts": attempts}
+
+    # Продлевает аренду ещё на lease секунд; False — задача уже не принадлежит этому обработчику
+    def heartbeat(self, job_id, worker, attempts) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND worker = ? AND attempts = ?",
+                (time.time() + self.lease, job_id, worker, attempts),
+            )
+            return cursor.rowcount == 1
+
+    # Выполненная (или окончательно проваленная) задача удаляется. Без worker — безусловно
+    # (задачи, которые никто не арендует); False — задачу уже забрал другой обработчик
+    def complete(self, job_id, worker=None, attempts=None) -> bool:
+        with self._lock:
+            if worker is None:
+                cursor = self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            else:
+                cursor = self._conn.execute(
+                    "DELETE FROM jobs WHERE id = ? AND worker = ? AND attempts = ?", (job_id, worker, attempts)
+                )
+            return cursor.rowcount == 1
+
+    # Возвращает задачу в очередь, не засчитывая попытку (обработчик останавливается)
+    def release(self, job_id, worker, attempts) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, attempts = attempts - 1 "
+                "WHERE id = ? AND status = 'running' AND worker = ? AND attempts = ?",
+                (job_id, worker, attempts),
+            )
+            return cursor.rowcount == 1
+
+    def depth(self, kinds=None) -> int:
+        query = "SELECT COUNT(*) FROM jobs WHERE status = 'queued'"
+        if kinds:
+            query += f" AND kind IN ({','.join('?' * len(kinds))})"
+        with self._lock:
+            return self._conn.execute(query, list(kinds or ())).fetchone()[0]
+
+    def running(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RelayedOutbox:
+    """
+    Исходящие сообщения обработчика из отдельного процесса (worker.py). Вместо отправки
+    send и edit ставят в брокер задачу OUTBOUND, а отправляет её основной процесс через свой
+    OutboundScheduler (deliver): темп по чатам, приоритеты и слияние правок общие для всех
+    процессов. wait дожидается только постановки в брокер; kwargs должны сериализоваться в JSON.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def send(self, bot, chat_id, text, lane=INTERACTIVE, wait=True, **kwargs) -> None:
+        await self._enqueue({"method": "send", "chat_id": chat_id, "text": text, "lane": lane, "kwargs": kwargs})
+
+    async def edit(self, bot, chat_id, message_id, text, wait=True, **kwargs) -> None:
+        await self._enqueue({"method": "edit", "chat_id": chat_id, "message_id": message_id, "text": text,
+                             "lane": EDITS, "kwargs": kwargs})
+
+    async def _enqueue(self, payload) -> None:
+        await asyncio.to_thread(self.broker.enqueue, OUTBOUND, payload)
+
+    # Отправка задачи OUTBOUND через outbox основного процесса (не дожидаясь ответа Telegram)
+    @staticmethod
+    async def deliver(outbox, bot, payload) -> None:
+        if payload["method"] == "edit":
+            await outbox.edit(bot, payload["chat_id"], payload["message_id"], payload["text"], wait=False,
+                              **payload["kwargs"])
+        else:
+            await outbox.send(bot, payload["chat_id"], payload["text"], lane=payload["lane"], wait=False,
+                              **payload["kwargs"])
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TranscriptCache:
+    """
+    Кэш расшифровок по содержимому: ключ — file_unique_id файла Telegram, движок и язык.
+    Первый уровень — LRU в памяти, второй (необязательный) — SQLite на диске
+    с удалением по суммарному размеру (max_disk_bytes). Срок жизни ttl общий для обоих уровней.
+    Суммарный размер на диске ведётся счётчиком; файл могут дополнять и другие процессы,
+    поэтому счётчик пересчитывается по таблице раз в RESYNC_EVERY записей и перед вытеснением.
+    """
+
+    RESYNC_EVERY = 256
+
+    def __init__(self, max_items=1000, disk_path=None, ttl=30 * 24 * 3600, max_disk_bytes=50 * 1024 * 1024):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        self._puts_since_resync = 0
+        if disk_path:
+            directory = os.path.dirname(disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(disk_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL, "
+                "accessed REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS transcripts_accessed ON transcripts (accessed)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS transcripts_created ON transcripts (created)")
+            self._disk_bytes = self._disk_total()
+
+    @staticmethod
+    def key(file_unique_id, engine, language) -> str:
+        return f"{engine}:{language}:{file_unique_id}"
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_items": len(self._memory),
+        }
+
+    async def get(self, key):
+        item = self._memory.get(key)
+        if item is not None:
+            text, created = item
+            if time.time() - created <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return text
+            del self._memory[key]
+        if self._conn is not None:
+            row = await asyncio.to_thread(self._disk_get, key)
+            if row is not None:
+                text, created = row
+                self._remember(key, text, created)
+                self.hits += 1
+                self.disk_hits += 1
+                return text
+        self.misses += 1
+        return None
+
+    async def put(self, key, text) -> None:
+        self._remember(key, text, time.time())
+        if self._conn is not None:
+            await asyncio.to_thread(self._disk_put, key, text)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+            self._conn = None
+
+    def _remember(self, key, text, created) -> None:
+        self._memory[key] = (text, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT text, created FROM transcripts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            text, created = row
+            if now - created > self.ttl:
+                self._conn.execute("DELETE FROM transcripts WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE transcripts SET accessed = ? WHERE key = ?", (now, key))
+            return text, created
+
+    def _disk_total(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM transcripts").fetchone()[0]
+
+    def _disk_put(self, key, text) -> None:
+        now = time.time()
+        size = len(text.encode())
+        with self._lock, self._conn:
+            replaced = self._conn.execute("SELECT size FROM transcripts WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO transcripts (key, text, created, accessed, size) VALUES (?, ?, ?, ?, ?)",
+                (key, text, now, now, size),
+            )
+            self._disk_bytes += size - (replaced[0] if replaced else 0)
+            # Удаляем просроченные записи (по индексу created)
+            expired = self._conn.execute(
+                "DELETE FROM transcripts WHERE created < ? RETURNING size", (now - self.ttl,)
+            ).fetchall()
+            self._disk_bytes -= sum(row[0] for row in expired)
+
+            self._puts_since_resync += 1
+            if self._puts_since_resync >= self.RESYNC_EVERY or self._disk_bytes > self.max_disk_bytes:
+                self._disk_bytes = self._disk_total()
+                self._puts_since_resync = 0
+            if self._disk_bytes <= self.max_disk_bytes:
+                return
+
+            # Затем самые давно запрошенные, пока не уложимся в лимит
+            freed = 0
+            evict = []
+            for old_key, old_size in self._conn.execute("SELECT key, size FROM transcripts ORDER BY accessed"):
+                if self._disk_bytes - freed <= self.max_disk_bytes:
+                    break
+                evict.append((old_key,))
+                freed += old_size
+            self._conn.executemany("DELETE FROM transcripts WHERE key = ?", evict)
+            self._disk_bytes -= freed
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import math
+import time
+
+
+class TimerWheel:
+    """
+    Хешированное колесо таймеров: size ячеек по tick секунд. Таймер кладётся в ячейку
+    (текущая + число тиков) с числом оставшихся оборотов, поэтому вставка и отмена — O(1),
+    а каждый тик просматривает только одну ячейку. Точность срабатывания — до tick.
+    """
+
+    def __init__(self, tick=0.5, size=512):
+        self.tick = tick
+        self.size = size
+        self._slots = [{} for _ in range(size)]
+        self._where = {}
+        self._cursor = 0
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def schedule(self, key, delay) -> None:
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay / self.tick))
+        index = (self._cursor + ticks) % self.size
+        self._slots[index][key] = (ticks - 1) // self.size
+        self._where[key] = index
+
+    def cancel(self, key) -> None:
+        index = self._where.pop(key, None)
+        if index is not None:
+            del self._slots[index][key]
+
+    # Сдвиг на один тик; возвращает ключи сработавших таймеров
+    def advance(self) -> list:
+        self._cursor = (self._cursor + 1) % self.size
+        slot = self._slots[self._cursor]
+        expired = []
+        for key, rounds in list(slot.items()):
+            if rounds:
+                slot[key] = rounds - 1
+            else:
+                del slot[key]
+                del self._where[key]
+                expired.append(key)
+        return expired
+
+
+class ExpiringStore:
+    """
+    Состояние интерактивных подтверждений (кнопки «Да/Отмена» и т.п.) с ограниченным сроком жизни.
+    Ключ — например, (chat_id, message_id) сообщения с кнопками. pop() при ответе пользователя
+    снимает таймер за O(1); истёкшие записи раз в тик передаются в on_expire одной пачкой
+    списком пар (ключ, значение). Пока хранилище пустое, фоновая задача спит.
+    """
+
+    def __init__(self, ttl, tick=0.5, size=512):
+        self.ttl = ttl
+        self.expired = 0
+        self._wheel = TimerWheel(tick, size)
+        self._items = {}
+        self._on_expire = None
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, key, value, ttl=None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self._items[key] = (value, time.monotonic() + ttl)
+        # Лишний тик: текущий тик уже начался, а срабатывать раньше срока нельзя
+        self._wheel.schedule(key, ttl + self._wheel.tick)
+        self._wake.set()
+
+    # Значение, если срок ещё не вышел (таймер мог не сработать до конца тика)
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None or item[1] <= time.monotonic():
+            return None
+        return item[0]
+
+    def pop(self, key):
+        value = self.get(key)
+        if key in self._items:
+            del self._items[key]
+            self._wheel.cancel(key)
+        return value
+
+    async def start(self, on_expire) -> None:
+        self._on_expire = on_expire
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        tick = self._wheel.tick
+        next_tick = time.monotonic() + tick
+        while True:
+            if not self._items:
+                self._wake.clear()
+                await self._wake.wait()
+                # Колесо стояло: сдвигаемся с текущего момента, а не догоняем пропущенные тики
+                next_tick = time.monotonic() + tick
+            await asyncio.sleep(max(next_tick - time.monotonic(), 0))
+            next_tick += tick
+
+            expired = []
+            for key in self._wheel.advance():
+                value, _ = self._items.pop(key)
+                expired.append((key, value))
+            if not expired:
+                continue
+            self.expired += len(expired)
+            try:
+                await self._on_expire(expired)
+            except Exception as e:
+                logging.error(f"Ошибка при обработке истёкших подтверждений: {e}")
@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import re
+import time
+
+# Латинские буквы, похожие на кириллические, и «ё» приводим к одному виду,
+# чтобы «мaйнкрафт» с латинской «a» тоже находился
+_HOMOGLYPHS = str.maketrans({
+    "a": "а", "c": "с", "e": "е", "k": "к", "o": "о", "p": "р", "x": "х", "y": "у", "ё": "е",
+})
+
+
+def normalize(text: str) -> str:
+    return text.lower().translate(_HOMOGLYPHS)
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class KeywordRule:
+    """Правило ответа на ключевые слова. chats — набор chat_id, где правило действует (None — везде)."""
+
+    __slots__ = ("id", "keywords", "response", "whole_word", "cooldown", "chats")
+
+    def __init__(self, id, keywords, response, whole_word=False, cooldown=0.0, chats=None):
+        self.id = id
+        self.keywords = [normalize(keyword) for keyword in keywords if keyword]
+        self.response = response
+        self.whole_word = whole_word
+        self.cooldown = cooldown
+        self.chats = frozenset(str(chat_id) for chat_id in chats) if chats else None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "KeywordRule":
+        return cls(
+            data["id"],
+            data["keywords"],
+            data["response"],
+            whole_word=data.get("whole_word", False),
+            cooldown=float(data.get("cooldown", 0)),
+            chats=data.get("chats"),
+        )
+
+
+class KeywordEngine:
+    """
+    Все правила компилируются в одно регулярное выражение, и текст просматривается за один проход.
+    Выражение обёрнуто в просмотр вперёд, поэтому находятся и пересекающиеся ключевые слова;
+    более короткие слова, являющиеся началом более длинного, добавляются по заранее
+    посчитанной таблице префиксов.
+    Кулдауны хранятся только для правил с cooldown, пока он не истёк: раз в PRUNE_INTERVAL
+    секунд истёкшие записи удаляются, чтобы словарь не рос с каждым новым чатом.
+    """
+
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self, rules=()):
+        self._rules = []
+        self._pattern = None
+        self._by_keyword = {}
+        self._prefixes = {}
+        self._cooldown_until = {}
+        self._next_prune = 0.0
+        self._path = None
+        self._mtime = None
+        self.compile(rules)
+
+    @property
+    def rules(self):
+        return list(self._rules)
+
+    def compile(self, rules) -> None:
+        rules = list(rules)
+        by_keyword = {}
+        for rule in rules:
+            for keyword in rule.keywords:
+                by_keyword.setdefault(keyword, []).append(rule)
+
+        keywords = sorted(by_keyword, key=len, reverse=True)
+        prefixes = {
+            keyword: [other for other in keywords if len(other) < len(keyword) and keyword.startswith(other)]
+            for keyword in keywords
+        }
+        pattern = None
+        if keywords:
+            pattern = re.compile("(?=(" + "|".join(re.escape(keyword) for keyword in keywords) + "))")
+
+        # Подменяем всё сразу, чтобы параллельные обработчики не увидели половину правил
+        self._rules, self._by_keyword, self._prefixes, self._pattern = rules, by_keyword, prefixes, pattern
+        known = {rule.id for rule in rules}
+        self._cooldown_until = {key: value for key, value in self._cooldown_until.items() if key[0] in known}
+
+    # Загрузка правил из JSON-файла вида {"rules": [...]}
+    def load(self, path) -> None:
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        self.compile(KeywordRule.from_dict(item) for item in data.get("rules", []))
+        self._path = path
+        self._mtime = os.path.getmtime(path)
+        logging.info(f"Загружено правил ключевых слов: {len(self._rules)} из {path}")
+
+    # Перечитывает файл, если он изменился с последней загрузки
+    def reload_if_changed(self) -> bool:
+        if not self._path:
+            return False
+        try:
+            mtime = os.path.getmtime(self._path)
+        except OSError as e:
+            logging.error(f"Ошибка при проверке файла правил ключевых слов: {e}")
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            self.load(self._path)
+            return True
+        except Exception as e:
+            # Битый файл не должен ломать уже работающие правила; повторно его не перечитываем
+            self._mtime = mtime
+            logging.error(f"Ошибка при перезагрузке правил ключевых слов: {e}")
+            return False
+
+    # Возвращает правила, сработавшие на тексте в этом чате (с учётом кулдаунов)
+    def match(self, chat_id, text, now=None):
+        if self._pattern is None or not text:
+            return []
+        normalized = normalize(text)
+        now = time.monotonic() if now is None else now
+        matched = []
+        seen = set()
+        for found in self._pattern.finditer(normalized):
+            start = found.start()
+            longest = found.group(1)
+            for keyword in (longest, *self._prefixes[longest]):
+                for rule in self._by_keyword[keyword]:
+                    if rule.id in seen:
+                        continue
+                    if rule.whole_word and not self._is_whole_word(normalized, start, start + len(keyword)):
+                        continue
+                    seen.add(rule.id)
+                    matched.append(rule)
+
+        if now >= self._next_prune:
+            self._prune(now)
+
+        fired = []
+        for rule in matched:
+            if rule.chats is not None and chat_id not in rule.chats:
+                continue
+            if rule.cooldown:
+                key = (rule.id, chat_id)
+                if now < self._cooldown_until.get(key, now):
+                    continue
+                self._cooldown_until[key] = now + rule.cooldown
+            fired.append(rule)
+        return fired
+
+    # Удаляем кулдауны, которые уже истекли
+    def _prune(self, now) -> None:
+        self._cooldown_until = {key: until for key, until in self._cooldown_until.items() if until > now}
+        self._next_prune = now + self.PRUNE_INTERVAL
+
+    @staticmethod
+    def _is_whole_word(text, start, end) -> bool:
+        if start > 0 and _is_word_char(text[start - 1]):
+            return False
+        if end < len(text) and _is_word_char(text[end]):
+            return False
+        return True
@@ -0,0 +1,163 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Контекст текущего обновления: попадает в каждую запись лога, сделанную из обработчика
+current_chat = contextvars.ContextVar("log_chat", default=None)
+current_handler = contextvars.ContextVar("log_handler", default=None)
+
+
+# Привязка записей лога к обработчику и чату; вернуть прежний контекст — reset(tokens)
+def bind(handler, chat_id=None) -> tuple:
+    return current_handler.set(handler), current_chat.set(chat_id)
+
+
+def reset(tokens) -> None:
+    current_handler.reset(tokens[0])
+    current_chat.reset(tokens[1])
+
+
+# Разбор "handle_message=WARNING,httpx=WARNING" в {имя: уровень}
+def parse_levels(value) -> dict:
+    levels = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        name, _, level = item.partition("=")
+        number = logging.getLevelName(level.strip().upper())
+        if not isinstance(number, int):
+            raise ValueError(f"Неизвестный уровень логирования: {item}")
+        levels[name.strip()] = number
+    return levels
+
+
+class ContextFilter(logging.Filter):
+    """
+    Добавляет в запись поля chat_id и handler из контекста обновления и отсекает записи
+    ниже уровня, заданного для обработчика или логгера (levels: {имя: уровень}), а без
+    отдельного уровня — ниже общего default.
+    """
+
+    def __init__(self, levels=None, default=logging.INFO):
+        super().__init__()
+        self.levels = levels or {}
+        self.default = default
+
+    def filter(self, record) -> bool:
+        record.handler = current_handler.get()
+        record.chat_id = current_chat.get()
+        level = self.levels.get(record.handler)
+        if level is None:
+            level = self.levels.get(record.name, self.default)
+        return record.levelno >= level
+
+
+class ThrottleFilter(logging.Filter):
+    """
+    Ограничение частых строк лога: записи с extra={"throttle": ключ} пропускаются не чаще
+    burst раз за per секунд на ключ. Число отброшенных записей выводится в следующей
+    пропущенной (поле suppressed). Записи без ключа не ограничиваются.
+    """
+
+    def __init__(self, burst=10, per=60.0):
+        super().__init__()
+        self.burst = burst
+        self.per = per
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record) -> bool:
+        key = getattr(record, "throttle", None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.per:
+                window = self._windows[key] = [now, 0, window[2] if window else 0]
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            record.suppressed, window[2] = window[2], 0
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат; контекст обновления и число отброшенных записей — в конце строки."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record) -> str:
+        line = super().format(record)
+        context = []
+        if getattr(record, "handler", None):
+            context.append(f"handler={record.handler}")
+        if getattr(record, "chat_id", None) is not None:
+            context.append(f"chat={record.chat_id}")
+        if getattr(record, "suppressed", 0):
+            context.append(f"пропущено похожих: {record.suppressed}")
+        return f"{line} [{', '.join(context)}]" if context else line
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна запись — одна строка JSON: время, уровень, логгер, сообщение, обработчик и чат.
+    Трассировка исключения уже добавлена к сообщению при постановке записи в очередь.
+    """
+
+    def format(self, record) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("handler", "chat_id", "suppressed"):
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# Логирование через очередь: вызовы logging только кладут запись в очередь, а форматирование
+# и запись в stderr идут в отдельном потоке. Возвращает запущенный QueueListener.
+def setup_logging(level="INFO", fmt="text", levels="", throttle_burst=10, throttle_per=60.0):
+    per_name = parse_levels(levels)
+    default = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    if not isinstance(default, int):
+        raise ValueError(f"Неизвестный уровень логирования: {level}")
+    # Имена из LOG_LEVELS — и обработчики, и логгеры (например, httpx)
+    for name, name_level in per_name.items():
+        logging.getLogger(name).setLevel(name_level)
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    # Фильтры стоят на QueueHandler: контекст обновления читается в потоке, где сделана запись
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(ContextFilter(per_name, default))
+    handler.addFilter(ThrottleFilter(throttle_burst, throttle_per))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    # Корневой уровень — самый подробный из заданных, остальное отсекает ContextFilter
+    root.setLevel(min([default, *per_name.values()]))
+
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    # При выходе дописываем всё, что осталось в очереди
+    atexit.register(listener.stop)
+    return listener
@@ -1,19 +1,43 @@
+import time
+
+# Отсчёт холодного старта: отчёт по этапам пишется в лог после первого обработанного обновления
+startup_marks = [("start", time.perf_counter())]
+
 import logging
 import asyncio
-import json
 import os
-import nest_asyncio
+import signal
+import socket
 from datetime import datetime, timezone
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Message, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, JobQueue
-from pydub import AudioSegment
-import speech_recognition as sr
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ChatMemberHandler, JobQueue, TypeHandler, ApplicationHandlerStop
 import random
 from dotenv import load_dotenv
+from persistence import WriteBehind
+from registry import MemberRegistry
+from storage import open_storage
+from transcription import TranscriptionQueue, QueueFull
+from voice import VoiceTranscriber
+from broker import OUTBOUND, JobBroker, RelayedOutbox
+from cache import TranscriptCache
+from keywords import KeywordEngine
+from resolver import MemberResolver
+from mentions import build_mention_chunks
+from sender import BULK, OutboundScheduler
+from stale import StaleUpdateFilter
+from ratelimit import Limit, RateLimiter
+from roster import RosterCache, RosterSync, is_member
+from expiring import ExpiringStore
+from logsetup import setup_logging
+import metrics
+from metrics import CallbackCounter, CallbackGauge, InstrumentedRequest, MetricsServer, instrument
+
+# Аудио (numpy, ffmpeg), распознавание речи и aiohttp импортируются при первом использовании
+startup_marks.append(("imports", time.perf_counter()))
 
 # Список ответов для "Magic 8 Ball"
-magic_8_ball_responses = [
+magic_8_ball_responses = (
     "Без сомнений", "Определенно да", "Никаких сомнений", "Да", "Очень вероятно",
     "Знаки говорят да", "Пока не ясно, попробуй снова", "Спроси позже",
     "Лучше не говорить сейчас", "Сконцентрируйся и спроси снова", "Не рассчитывай на это",
@@ -38,16 +62,22 @@ magic_8_ball_responses = [
     "Вселенная говорит «да», но ты можешь спросить еще раз.",
     "Ответ есть, но он находится за пределами твоего понимания.",
     "Истина где-то рядом, но не здесь.", "А что такое «правда» вообще?"
-]
-# Включаем логирование
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
-
-# Разрешаем вложенные циклы событий
-nest_asyncio.apply()
-
+)
 # Загрузка переменных окружения из .env файла
 load_dotenv()
 
+# Включаем логирование: запись в отдельном потоке, формат text или json (LOG_FORMAT),
+# уровни отдельных обработчиков и логгеров — LOG_LEVELS="handle_message=WARNING,httpx=WARNING"
+log_listener = setup_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    fmt=os.getenv('LOG_FORMAT', 'text'),
+    levels=os.getenv('LOG_LEVELS', ''),
+    throttle_burst=int(os.getenv('LOG_THROTTLE_BURST', '10')),
+    throttle_per=float(os.getenv('LOG_THROTTLE_PERIOD', '60')),
+)
+# Ошибки, пойманные и записанные в лог обработчиками, тоже попадают в bot_handler_errors_total
+metrics.count_logged_errors()
+
 
 # Проверка, что токен и chat_id загружены
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')  # Ваш токен, полученный от BotFather
@@ -55,15 +85,40 @@ if not TELEGRAM_TOKEN:
     print("Ошибка: не заданы TELEGRAM_TOKEN в .env файле.")
     exit(1)
 
+# Адрес Bot API (например, локальный telegram-bot-api); по умолчанию api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+TELEGRAM_FILE_URL = os.getenv('TELEGRAM_FILE_URL')
+
+# Режим получения обновлений: polling (long polling) или webhook (локальный HTTP-приёмник)
+RUN_MODE = os.getenv('RUN_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес, который получит Telegram
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Без секрета приёмник принял бы поддельные обновления от любого, кто до него достучится
+if RUN_MODE == "webhook" and not WEBHOOK_SECRET:
+    print("Ошибка: для RUN_MODE=webhook нужно задать WEBHOOK_SECRET в .env файле.")
+    exit(1)
+# Сколько секунд при остановке ждать завершения уже принятой работы
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '30'))
+
+# Локальный адрес для /metrics (порт 0 — выключено) и профилирование медленных обработчиков
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+PROFILE_HANDLERS = int(os.getenv('PROFILE_HANDLERS', '0'))  # Сколько самых медленных вызовов хранить
+
 # Путь к файлу для сохранения данных
 DATA_FILE = "data/active_users.json"
 
-# Загружаем данные из файла, если он существует
-if os.path.exists(DATA_FILE):
-    with open(DATA_FILE, 'r') as file:
-        chat_data = json.load(file)
-else:
-    chat_data = {}  # Если файла нет, создаем пустой словарь
+# Хранилище участников: json (один файл) или sqlite (построчная запись, WAL)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+SQLITE_FILE = os.getenv('SQLITE_FILE', 'data/bot.db')
+
+storage = open_storage(STORAGE_BACKEND, DATA_FILE, SQLITE_FILE)
+
+# Участники чата загружаются из хранилища при первом обновлении из этого чата (в потоке, см. preload_chat)
+chat_data = MemberRegistry(loader=storage.load_chat)
 
 # Флаг для отслеживания состояния бота
 bot_active = False
@@ -71,14 +126,194 @@ bot_active = False
 # Время, когда бот запустился
 bot_start_time = datetime.now(timezone.utc)
 
+# Что делать с сообщениями, накопившимися за время простоя: drop — Telegram сбрасывает их
+# при запуске, register — авторы добавляются в участники одной пачкой, без обработчиков
+STALE_UPDATE_POLICY = os.getenv('STALE_UPDATE_POLICY', 'register')
+
+
+# Отложенная запись данных в хранилище (по таймеру или по количеству изменений).
+# Снимок готовится в цикле событий, чтобы запись в потоке не пересекалась с обработчиками
+persistence = WriteBehind(
+    lambda keys: storage.snapshot(chat_data, keys),
+    storage.write,
+    interval=float(os.getenv('PERSIST_INTERVAL', '5')),
+    max_pending=int(os.getenv('PERSIST_MAX_PENDING', '100')),
+)
+
+
+# Все исходящие сообщения идут через общую очередь с приоритетами: ответы на команды,
+# затем правки, затем рассылки. Паузы между правками и между сообщениями рассылки в одном чате,
+# общий предел — OUTBOUND_RATE сообщений в секунду (лимит Telegram — около 30)
+outbox = OutboundScheduler(intervals=(
+    0.0,
+    float(os.getenv('EDIT_INTERVAL', '1')),
+    float(os.getenv('TAG_ALL_INTERVAL', '3')),
+), global_rate=float(os.getenv('OUTBOUND_RATE', '30')))
+
+# Очередь расшифровки голосовых: число параллельных задач и максимальная длина очереди
+transcription_queue = TranscriptionQueue(
+    workers=int(os.getenv('TRANSCRIBE_WORKERS', '2')),
+    max_depth=int(os.getenv('TRANSCRIBE_QUEUE_SIZE', '20')),
+)
+
+
+# Файлы больше этого размера (байт) при скачивании уходят из памяти во временный файл
+AUDIO_MEMORY_LIMIT = int(os.getenv('AUDIO_MEMORY_LIMIT', str(20 * 1024 * 1024)))
+
+
+# Движок распознавания речи: google (сетевой) или vosk (локальный, нужна модель VOSK_MODEL_PATH)
+STT_LANGUAGE = os.getenv('STT_LANGUAGE', 'ru-RU')
+STT_CHUNK_SECONDS = float(os.getenv('STT_CHUNK_SECONDS', '25'))
+# Предел длины речи в секундах (0 — без предела, длинное аудио режется на фрагменты)
+# и порог тишины в дБ, ниже которого начало и конец записи обрезаются
+STT_MAX_SECONDS = float(os.getenv('STT_MAX_SECONDS', '600'))
+STT_SILENCE_DB = float(os.getenv('STT_SILENCE_DB', '-45'))
+STT_ENGINE = os.getenv('STT_ENGINE', 'google')
+
+
+# Кэш расшифровок: в памяти и (если задан TRANSCRIPT_CACHE_FILE) на диске
+transcript_cache = TranscriptCache(
+    max_items=int(os.getenv('TRANSCRIPT_CACHE_SIZE', '1000')),
+    disk_path=os.getenv('TRANSCRIPT_CACHE_FILE') or None,
+    ttl=float(os.getenv('TRANSCRIPT_CACHE_TTL', str(30 * 24 * 3600))),
+    max_disk_bytes=int(os.getenv('TRANSCRIPT_CACHE_MAX_BYTES', str(50 * 1024 * 1024))),
+)
+
+voice_transcriber = VoiceTranscriber(
+    transcription_queue, transcript_cache, STT_ENGINE, STT_LANGUAGE,
+    chunk_seconds=STT_CHUNK_SECONDS, memory_limit=AUDIO_MEMORY_LIMIT, vosk_model_path=os.getenv('VOSK_MODEL_PATH'),
+    max_seconds=STT_MAX_SECONDS or None, silence_db=STT_SILENCE_DB, outbox=outbox,
+)
+
+# Очередь задач для отдельных процессов-обработчиков (worker.py). Если задана, голосовые
+# расшифровывают они, а этот процесс только принимает обновления; пусто — всё в этом процессе
+TRANSCRIBE_BROKER = os.getenv('TRANSCRIBE_BROKER')
+job_broker = JobBroker(TRANSCRIBE_BROKER) if TRANSCRIBE_BROKER else None
+# Правки от обработчиков отправляет этот процесс: как часто проверять брокер, когда их нет
+RELAY_INTERVAL = float(os.getenv('RELAY_INTERVAL', '0.2'))
+RELAY_ID = f"relay:{socket.gethostname()}:{os.getpid()}"
+relay_task = None
+
+# Участники общие с обработчиками, если хранилище общее (sqlite): имена для /check_all получают
+# они, а бот раз в SHARED_STATE_INTERVAL секунд перечитывает чаты, изменённые другими процессами
+SHARED_STATE = job_broker is not None and storage.shared
+SHARED_STATE_INTERVAL = float(os.getenv('SHARED_STATE_INTERVAL', '2'))
+shared_seq = storage.changes_since(None)[0] if SHARED_STATE else 0
+# Чаты, для которых задача получения имён уже поставлена: {chat_id: когда можно ставить снова}
+NAME_JOB_INTERVAL = 60.0
+name_jobs = {}
+if job_broker is not None and not storage.shared:
+    logging.warning("Хранилище json не общее с обработчиками: имена участников бот получает сам")
+
+
+# Правила ответов на ключевые слова: файл перечитывается без перезапуска, если изменился
+KEYWORDS_FILE = os.getenv('KEYWORDS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'keywords.json'))
+KEYWORDS_RELOAD_INTERVAL = float(os.getenv('KEYWORDS_RELOAD_INTERVAL', '30'))
+keyword_engine = KeywordEngine()
+try:
+    keyword_engine.load(KEYWORDS_FILE)
+except Exception as e:
+    logging.error(f"Ошибка при загрузке правил ключевых слов: {e}")
+
+
+# Параллельное получение имён участников из Telegram с учётом лимитов
+member_resolver = MemberResolver(
+    concurrency=int(os.getenv('RESOLVE_CONCURRENCY', '8')),
+    ttl=float(os.getenv('RESOLVE_CACHE_TTL', '3600')),
+)
+
+
+# Число упоминаний в одном сообщении /tag_all
+TAG_ALL_MENTIONS_PER_MESSAGE = int(os.getenv('TAG_ALL_MENTIONS_PER_MESSAGE', '50'))
+
+
+# Готовые ответы /check_all и число участников чата (ведётся по событиям входа и выхода)
+roster_cache = RosterCache()
+
+# Фоновая сверка участников: раз в ROSTER_SYNC_INTERVAL секунд (0 — выключена) проверяется
+# ROSTER_SYNC_BATCH участников, число участников чата перезапрашивается раз в ROSTER_COUNT_AGE секунд
+ROSTER_SYNC_INTERVAL = float(os.getenv('ROSTER_SYNC_INTERVAL', '60'))
+ROSTER_SYNC_BATCH = int(os.getenv('ROSTER_SYNC_BATCH', '20'))
+ROSTER_COUNT_AGE = float(os.getenv('ROSTER_COUNT_AGE', '3600'))
+
+
+# Неподтверждённые /tag_all по сообщению с кнопками; через TAG_CONFIRM_TTL секунд кнопки убираются
+confirmations = ExpiringStore(ttl=float(os.getenv('TAG_CONFIRM_TTL', '15')))
+
+
+# Ограничение частоты дорогих команд (лимиты — при регистрации обработчиков)
+rate_limiter = RateLimiter(enabled=os.getenv('RATE_LIMITS', '1') != '0', notify=outbox.reply)
+
+
+# Метрики очереди расшифровки и кэша
+metrics.registry.register(CallbackGauge(
+    "bot_transcription_queue_depth", "Задачи расшифровки в очереди", lambda: transcription_queue.depth))
+metrics.registry.register(CallbackGauge(
+    "bot_transcription_busy_workers", "Занятые обработчики расшифровки", lambda: transcription_queue.busy))
+metrics.registry.register(CallbackCounter(
+    "bot_transcript_cache_hits_total", "Попадания в кэш расшифровок", lambda: transcript_cache.hits))
+metrics.registry.register(CallbackCounter(
+    "bot_transcript_cache_misses_total", "Промахи кэша расшифровок", lambda: transcript_cache.misses))
+metrics.registry.register(CallbackGauge(
+    "bot_outbound_queue_depth", "Исходящие сообщения в очереди", lambda: outbox.depth))
+metrics.registry.register(CallbackCounter(
+    "bot_outbound_edits_coalesced_total", "Правки, слитые с более новыми", lambda: outbox.coalesced))
+metrics.registry.register(CallbackCounter(
+    "bot_roster_cache_hits_total", "Ответы /check_all из кэша", lambda: roster_cache.hits))
+metrics.registry.register(CallbackGauge(
+    "bot_pending_confirmations", "Ожидающие подтверждения /tag_all", lambda: len(confirmations)))
+metrics.registry.register(CallbackCounter(
+    "bot_rate_limited_total", "Команды, отклонённые лимитом частоты", lambda: rate_limiter.rejected))
+metrics.registry.register(CallbackCounter(
+    "bot_rate_merged_total", "Повторные команды, объединённые с уже выполняющимися", lambda: rate_limiter.merged))
+if PROFILE_HANDLERS:
+    metrics.enable_profiling(keep=PROFILE_HANDLERS)
+
+
+# Добавление авторов накопившихся сообщений, затем вход и выход участников из служебных
+# сообщений по порядку; возвращает число новых участников
+def register_stale_authors(authors, service=()) -> int:
+    added = []
+    for (chat_id, user_id), first_name in authors.items():
+        _, created = chat_data.add(chat_id, user_id, first_name)
+        if created:
+            save_data(chat_id, user_id)
+            added.append((chat_id, user_id))
+    for message in service:
+        apply_member_service_message(message)
+    return sum(1 for chat_id, user_id in added if chat_data.get(chat_id, user_id) is not None)
+
+
+stale_filter = StaleUpdateFilter(STALE_UPDATE_POLICY, register=register_stale_authors, started_at=bot_start_time)
+
+startup_marks.append(("state", time.perf_counter()))
+
+
+# Функция для пометки данных участника как изменённых (собранный список участников чата устаревает)
+def save_data(chat_id, user_id):
+    roster_cache.invalidate(chat_id)
+    persistence.mark_dirty((chat_id, user_id))
+
+
+roster_sync = RosterSync(chat_data, roster_cache, save_data, batch=ROSTER_SYNC_BATCH, count_age=ROSTER_COUNT_AGE)
 
-# Функция для сохранения данных в файл
-def save_data():
-    try:
-        with open(DATA_FILE, 'w') as file:
-            json.dump(chat_data, file)
-    except Exception as e:
-        logging.error(f"Ошибка при сохранении данных: {e}")
+
+# Дозаполняет first_name участников без имени одним параллельным пакетом запросов.
+# Изменения только помечаются — запишутся одной отложенной записью. wait=False при общих
+# участниках — имена получит обработчик, а бот увидит их при синхронизации (sync_shared_members)
+async def resolve_missing_names(context: ContextTypes.DEFAULT_TYPE, chat_id, members, wait=True) -> None:
+    missing = [member for member in members if not member.display_name]
+    if not missing:
+        return
+    if not wait and SHARED_STATE:
+        await submit_name_job(chat_id, missing)
+        return
+    names = await member_resolver.resolve_many(context.bot, int(chat_id), [member.id for member in missing])
+    for member in missing:
+        name = names.get(member.id)
+        if name:
+            member.first_name = name
+            save_data(chat_id, member.id)
 
 
 # Функция для добавления пользователей
@@ -87,59 +322,104 @@ async def add_user(update: Update) -> None:
         chat_id = str(update.effective_chat.id)  # Приводим chat_id к строке для использования в JSON
         user = update.message.from_user
 
-        # Если для чата еще нет данных, создаем новый список участников
-        if chat_id not in chat_data:
-            chat_data[chat_id] = []
-
-        # Проверяем, есть ли пользователь в списке
-        user_exists = False
-        for member in chat_data[chat_id]:
-            if member["id"] == user.id:
-                user_exists = True
-                break
-
-        # Если пользователя нет, добавляем его
-        if not user_exists:
-            new_user = {
-                "id": user.id,
-                "first_name": user.first_name,
-                "nickname": "",  # Пустой никнейм по умолчанию
-                "isAdmin": 0
-            }
-            chat_data[chat_id].append(new_user)
-            logging.info(f"Добавлен пользователь: {user.id} ({user.first_name}) в чат {chat_id}")
-
-        # Сохраняем данные в файл
-        save_data()
+        # Сообщение о выходе из чата приходит от имени вышедшего — его не добавляем
+        left = update.message.left_chat_member
+        if left is not None and left.id == user.id:
+            return
+
+        # Добавляем пользователя, если его ещё нет (поиск за O(1))
+        member, created = chat_data.add(chat_id, user.id, user.first_name)
+        if created:
+            logging.info(f"Добавлен пользователь: {user.id} ({user.first_name}) в чат {chat_id}",
+                         extra={"throttle": "add_user"})
+
+            # Помечаем данные к сохранению только при реальном изменении
+            save_data(chat_id, user.id)
+        elif user.first_name and member.first_name != user.first_name:
+            # Участник сменил имя
+            member.first_name = user.first_name
+            save_data(chat_id, user.id)
     except Exception as e:
         logging.error(f"Ошибка при добавлении пользователя: {e}")
 
 
-# Добавляем новую функцию для реакции на ключевые слова
-async def add_keyword_response(update: Update, keywords, response_text) -> None:
+# Служебные сообщения о входе и выходе участников (приходят и без прав администратора).
+# Число участников здесь не меняем, а перезапрашиваем: то же событие может прийти и как chat_member
+def apply_member_service_message(message) -> None:
+    chat_id = str(message.chat_id)
+    changed = False
+    for user in message.new_chat_members or ():
+        if not user.is_bot and chat_data.add(chat_id, user.id, user.first_name)[1]:
+            save_data(chat_id, user.id)
+        changed = True
+    left = message.left_chat_member
+    if left is not None:
+        if chat_data.remove(chat_id, left.id) is not None:
+            save_data(chat_id, left.id)
+        changed = True
+    if changed:
+        roster_cache.invalidate_count(chat_id)
+
+
+# Вход, выход, исключение участника (Telegram присылает их, только если бот — администратор чата)
+async def handle_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        # Проверяем, является ли это сообщение накопившимся
-        message_time = update.message.date
-        if message_time < bot_start_time:
-            logging.info(f"Игнорируем накопившееся сообщение от {update.message.from_user.first_name}")
+        change = update.chat_member
+        chat_id = str(change.chat.id)
+        user = change.new_chat_member.user
+        was_member, now_member = is_member(change.old_chat_member), is_member(change.new_chat_member)
+        if was_member != now_member:
+            roster_cache.adjust_count(chat_id, 1 if now_member else -1)
+        if user.is_bot:
             return
 
+        if now_member:
+            member, created = chat_data.add(chat_id, user.id, user.first_name)
+            if created or (user.first_name and member.first_name != user.first_name):
+                member.first_name = user.first_name
+                save_data(chat_id, user.id)
+        elif chat_data.remove(chat_id, user.id) is not None:
+            logging.info(f"Удалён вышедший участник: {user.id} из чата {chat_id}", extra={"throttle": "remove_user"})
+            save_data(chat_id, user.id)
+    except Exception as e:
+        logging.error(f"Ошибка при обработке изменения участника чата: {e}")
+
+
+# Бота добавили в чат, удалили из него или изменили его права: число участников запросим заново
+async def handle_my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    change = update.my_chat_member
+    chat_id = str(change.chat.id)
+    roster_cache.invalidate_count(chat_id)
+    roster_cache.invalidate(chat_id)
+    logging.info(f"Статус бота в чате {chat_id}: {change.old_chat_member.status} -> {change.new_chat_member.status}")
+
+
+# Медленная сверка участников с Telegram (события входа и выхода могли быть пропущены)
+async def sync_roster(context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        await roster_sync.run_once(context.bot)
+    except Exception as e:
+        logging.error(f"Ошибка при сверке участников: {e}")
+
+
+# Функция-обработчик реакций на ключевые слова: все правила проверяются за один проход по тексту
+async def handle_keyword_responses(update: Update) -> None:
+    try:
         # Проверяем, содержит ли сообщение текст
         if not hasattr(update.message, 'text') or update.message.text is None:
-            logging.info("Сообщение не содержит текста, игнорируем")
+            logging.debug("Сообщение не содержит текста, игнорируем")
             return
 
-        # Проверяем, содержит ли сообщение одно из ключевых слов
-        message_text = update.message.text.lower()
-        if any(keyword.lower() in message_text for keyword in keywords):
-            await update.message.reply_text(response_text)
+        chat_id = str(update.effective_chat.id)
+        for rule in keyword_engine.match(chat_id, update.message.text):
+            await outbox.reply(update.message, rule.response)
     except Exception as e:
         logging.error(f"Ошибка при обработке реакции на ключевые слова: {e}")
 
 
-# Функция-обработчик всех сообщений для использования add_keyword_response
-async def handle_keyword_responses(update: Update) -> None:
-    await add_keyword_response(update, ["майнкрафт", "minecraft"], "Кто сказал майнкрафт?")
+# Периодическая проверка файла правил ключевых слов
+async def reload_keyword_rules(context: ContextTypes.DEFAULT_TYPE) -> None:
+    keyword_engine.reload_if_changed()
 
 
 # Обновляем основной обработчик сообщений, добавляя функцию handle_keyword_responses
@@ -147,6 +427,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         # Добавляем пользователя из сообщения
         await add_user(update)
+        if update.message is not None:
+            apply_member_service_message(update.message)
         # Вызываем обработчик ключевых слов
         await handle_keyword_responses(update)
 
@@ -158,26 +440,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 # Функция для команды /tag_all с подтверждением и таймером
 async def tag_all(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        message_time = update.message.date
-        if message_time < bot_start_time:
-            logging.info(f"Игнорируем накопившееся /tag_all сообщение от {update.message.from_user.first_name}")
-            return
-
         chat_id = str(update.effective_chat.id)
         user_id = update.effective_user.id
 
         # Проверяем, есть ли активные пользователи
-        if chat_id not in chat_data or not chat_data[chat_id]:
-            await update.message.reply_text("Никто не взаимодействовал с ботом.")
+        if not chat_data.count(chat_id):
+            await outbox.reply(update.message, "Никто не взаимодействовал с ботом.")
             return
 
-        # Сохраняем данные в контексте пользователя
-        context.user_data["pending_tag"] = {
-            "chat_id": chat_id,
-            "user_id": user_id,
-            "timestamp": datetime.now(timezone.utc),
-        }
-
         # Создаем кнопки
         keyboard = [
             [InlineKeyboardButton("Да", callback_data="confirm_tag"),
@@ -186,140 +456,131 @@ async def tag_all(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         # Отправляем сообщение с кнопками
-        sent_message = await update.message.reply_text(
-            "Оно тебе надо?",
-            reply_markup=reply_markup
-        )
-
-        # Сохраняем ID сообщения, чтобы потом его обновить
-        context.user_data["pending_tag"]["message_id"] = sent_message.message_id
+        sent_message = await outbox.reply(update.message, "Оно тебе надо?", reply_markup=reply_markup)
 
-        # Устанавливаем таймер на удаление запроса через 15 сек
-        context.job_queue.run_once(expire_tag_confirmation, 15, user_id=user_id)
+        # Запрос привязан к сообщению с кнопками и истекает через TAG_CONFIRM_TTL секунд
+        confirmations.put((sent_message.chat_id, sent_message.message_id), {
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "expired_text": "Время подтверждения истекло.",
+        })
 
     except Exception as e:
         logging.error(f"Ошибка при выполнении команды /tag_all: {e}")
-        await update.message.reply_text("Произошла ошибка при выполнении команды.")
+        await outbox.reply(update.message, "Произошла ошибка при выполнении команды.")
+
+
+# Правка сообщения с кнопками через общую очередь отправки
+async def edit_query_message(query, text, **kwargs):
+    return await outbox.edit(query.get_bot(), query.message.chat_id, query.message.message_id, text, **kwargs)
 
 
 # Обработчик нажатия кнопок
 async def handle_tag_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    await query.answer()
+    key = (query.message.chat_id, query.message.message_id)
 
-    user_data = context.user_data.get("pending_tag")
-    if not user_data:
-        await query.edit_message_text("Запрос истёк или был отменён.")
+    pending = confirmations.get(key)
+    if not pending:
+        # Сообщение уже заменено (истекло, отменено или рассылка идёт) — только всплывающий ответ
+        await query.answer("Запрос истёк или был отменён.")
         return
 
-    now = datetime.now(timezone.utc)
-    if (now - user_data["timestamp"]).total_seconds() > 15:
-        await query.edit_message_text("Время подтверждения истекло.")
-        context.user_data.pop("pending_tag", None)
+    # Кнопки видны всему чату, но ответить может только тот, кто вызвал команду
+    if pending["user_id"] != query.from_user.id:
+        await query.answer("Подтвердить может только автор команды.")
         return
 
+    confirmations.pop(key)
+    await query.answer()
+
     if query.data == "confirm_tag":
-        await execute_tag_all(query, context, user_data)
+        await execute_tag_all(query, context, pending)
     elif query.data == "cancel_tag":
-        await query.edit_message_text("Действие отменено.")
-        context.user_data.pop("pending_tag", None)
+        await edit_query_message(query, "Действие отменено.")
 
 
 # Выполняет тег всех участников
-async def execute_tag_all(query, context, user_data):
-    chat_id = user_data["chat_id"]
-    mention_text = ""
-    errors_count = 0
+async def execute_tag_all(query, context, pending):
+    chat_id = pending["chat_id"]
+
+    members = chat_data.members(chat_id)
+    await resolve_missing_names(context, chat_id, members)
+
+    chunks = build_mention_chunks(
+        [(member.id, member.display_name) for member in members if member.display_name],
+        max_mentions=TAG_ALL_MENTIONS_PER_MESSAGE,
+    )
+    if not chunks:
+        await edit_query_message(query, "Не удалось упомянуть участников.")
+        return
 
-    for member in chat_data.get(chat_id, []):
-        try:
-            user_id_member = member["id"]
-            nickname = member["nickname"]
-            first_name = member.get("first_name")
-
-            if not nickname and not first_name:
-                user_info = await context.bot.get_chat_member(int(chat_id), user_id_member)
-                first_name = user_info.user.first_name
-                member["first_name"] = first_name
-                save_data()
-
-            display_name = nickname if nickname else first_name
-            mention_text += f"[{display_name}](tg://user?id={user_id_member}) "
-        except Exception as e:
-            logging.error(f"Ошибка при получении участника {user_id_member}: {e}")
-            errors_count += 1
+    await edit_query_message(query, "Это на твоей совести")
 
-    if len(mention_text) > 4096:
-        await query.edit_message_text("Слишком много участников для упоминания в одном сообщении.")
-    elif mention_text:
-        await query.edit_message_text("Это на твоей совести")
-        await context.bot.send_message(chat_id=int(chat_id), text=mention_text, parse_mode=ParseMode.MARKDOWN)
-    else:
-        await query.edit_message_text("Не удалось упомянуть участников.")
+    # Рассылка может идти минутами — выполняем её в фоне, чтобы не задерживать другие обновления
+    context.application.create_task(send_mention_chunks(query, context, int(chat_id), chunks))
 
-    context.user_data.pop("pending_tag", None)
 
+# Отправляет сообщения с упоминаниями с темпом, допустимым для чата, и показывает прогресс
+async def send_mention_chunks(query, context, chat_id, chunks) -> None:
+    total = len(chunks)
+    sent = 0
+    try:
+        for chunk in chunks:
+            await outbox.send(context.bot, chat_id, chunk, lane=BULK, parse_mode=ParseMode.HTML)
+            sent += 1
+            if total > 1:
+                # Прогресс не ждём: несколько правок подряд сольются в одну
+                await outbox.edit(context.bot, query.message.chat_id, query.message.message_id,
+                                  f"Это на твоей совести. Отправлено {sent}/{total}", wait=False)
+    except Exception as e:
+        logging.error(f"Ошибка при рассылке упоминаний в чат {chat_id}: {e}")
+        try:
+            await edit_query_message(query, f"Рассылка прервана: отправлено {sent}/{total}")
+        except Exception as edit_error:
+            logging.error(f"Ошибка при обновлении прогресса рассылки: {edit_error}")
 
-# Очистка истёкшего запроса
-async def expire_tag_confirmation(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    user_data = context.user_data.get("pending_tag")
 
-    if user_data and user_data["user_id"] == job.user_id:
+# Истёкшие подтверждения: кнопки убираем, сообщение заменяем текстом из запроса
+async def expire_confirmations(bot, expired):
+    for (chat_id, message_id), pending in expired:
         try:
-            chat_id = user_data["chat_id"]
-            message_id = user_data["message_id"]
-            await context.bot.edit_message_text(
-                chat_id=int(chat_id),
-                message_id=message_id,
-                text="Время подтверждения истекло."
-            )
+            await outbox.edit(bot, chat_id, message_id, pending["expired_text"], wait=False)
         except Exception as e:
             logging.error(f"Ошибка при обновлении истёкшего сообщения: {e}")
-        finally:
-            context.user_data.pop("pending_tag", None)
 
-# Функция для команды /check_all
-async def check_all(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+# Функция для команды /check_all. Возвращает отправленный ответ: его текст получат
+# повторные /check_all, объединённые с этой (см. RateLimiter.limit)
+async def check_all(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Message | None:
     try:
-        # Проверяем, является ли это сообщение накопившимся
-        message_time = update.message.date
-        if message_time < bot_start_time:
-            logging.info(f"Игнорируем накопившееся /check_all сообщение от {update.message.from_user.first_name}")
-            return
-
         chat_id = str(update.effective_chat.id)
 
         # Проверяем, есть ли активные пользователи для этого чата
-        if chat_id not in chat_data or not chat_data[chat_id]:
-            await update.message.reply_text("Нет активных пользователей в этом чате.")
-            return
+        if not chat_data.count(chat_id):
+            return await outbox.reply(update.message, "Нет активных пользователей в этом чате.")
+
+        # Общее количество участников в чате (из памяти; Telegram спрашиваем только для нового чата)
+        chat_members_count = await roster_cache.member_count(context.bot, chat_id)
+
+        # Список не менялся с прошлого раза — отвечаем готовым текстом
+        response_text = roster_cache.get(chat_id, chat_members_count)
+        if response_text is not None:
+            return await outbox.reply(update.message, response_text)
 
         user_names = []
         errors_count = 0  # Для подсчета ошибок при получении участников
 
-        # Получаем общее количество участников в чате
-        chat_members_count = await context.bot.get_chat_member_count(update.effective_chat.id)
-
-        for member in chat_data[chat_id]:
-            try:
-                user_id = member["id"]
-                nickname = member["nickname"]
-                first_name = member["first_name"]
-
-                if not nickname and not first_name:
-                    # Если first_name не задан, получаем его данные из Telegram
-                    user_info = await context.bot.get_chat_member(update.effective_chat.id, user_id)
-                    first_name = user_info.user.first_name
-                    member["first_name"] = first_name
-                    save_data()
-
-                # Используем nickname, если он задан, иначе first_name
-                display_name = nickname if nickname else first_name
-                user_names.append(display_name)
-            except Exception as e:
-                logging.error(f"Ошибка при получении участника {user_id}: {e}")
+        # Если first_name не задан, получаем данные из Telegram (параллельно, одним пакетом)
+        members = chat_data.members(chat_id)
+        await resolve_missing_names(context, chat_id, members, wait=False)
+
+        for member in members:
+            # Используем nickname, если он задан, иначе first_name
+            display_name = member.display_name
+            if not display_name:
                 errors_count += 1
+                continue
+            user_names.append(display_name)
 
         # Формируем ответ
         if user_names:
@@ -335,21 +596,19 @@ async def check_all(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         else:
             response_text = "Нет активных пользователей в этом чате."
 
-        await update.message.reply_text(response_text)
+        # Кэшируем только полный список: участников без имени попробуем получить в следующий раз
+        if not errors_count:
+            roster_cache.put(chat_id, chat_members_count, response_text)
+
+        return await outbox.reply(update.message, response_text)
     except Exception as e:
         logging.error(f"Ошибка при выполнении команды /check_all: {e}")
-        await update.message.reply_text("Произошла ошибка при выполнении команды.")
+        await outbox.reply(update.message, "Произошла ошибка при выполнении команды.")
 
 
 # Функция для обработки голосовых сообщений
 async def voice_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        # Проверяем, является ли это сообщение накопившимся
-        message_time = update.message.date
-        if message_time < bot_start_time:
-            logging.info(f"Игнорируем накопившееся голосовое сообщение от {update.message.from_user.first_name}")
-            return
-
         # Передаем голосовое сообщение для расшифровки
         await transcribe_voice(update, context, message=update.message)
 
@@ -359,81 +618,100 @@ async def voice_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 # Функция для расшифровки голосового сообщения или кружочка
 async def transcribe_voice(update: Update, context: ContextTypes.DEFAULT_TYPE, message=None) -> None:
-    file_path = None
-    wav_path = None
-
     try:
-        # Проверяем, является ли это сообщение накопившимся
-        message_time = update.message.date
-        if message_time < bot_start_time:
-            logging.info(f"Игнорируем накопившееся /voice сообщение от {update.message.from_user.first_name}")
-            return
-
         # Используем текущее сообщение, если оно передано
         if message is None:
             if update.message.reply_to_message and (
                     update.message.reply_to_message.voice or update.message.reply_to_message.video_note):
                 message = update.message.reply_to_message
             else:
-                await update.message.reply_text("Ответьте на голосовое сообщение или кружочек, чтобы его расшифровать.")
+                await outbox.reply(update.message, "Ответьте на голосовое сообщение или кружочек, чтобы его расшифровать.")
                 return
 
-        # Определяем, какой тип сообщения обрабатываем (голосовое или видеосообщение)
-        if message.voice:
-            # Обрабатываем голосовое сообщение
-            file = await context.bot.get_file(message.voice.file_id)
-            file_path = f"voice_{message.message_id}.ogg"
-        elif message.video_note:
-            # Обрабатываем видеосообщение (кружочек)
-            file = await context.bot.get_file(message.video_note.file_id)
-            file_path = f"video_note_{message.message_id}.mp4"
-        else:
-            await update.message.reply_text("Сообщение не содержит голосового сообщения или кружочка.")
+        if not message.voice and not message.video_note:
+            await outbox.reply(update.message, "Сообщение не содержит голосового сообщения или кружочка.")
             return
 
-        # Сохраняем файл
-        await file.download_to_drive(file_path)
+        # Заведомо слишком длинное аудио не скачиваем (после скачивания длина проверяется ещё раз)
+        media = message.voice or message.video_note
+        if STT_MAX_SECONDS and media.duration and media.duration > STT_MAX_SECONDS:
+            await outbox.reply(update.message,
+                               f"Слишком длинное сообщение ({media.duration} с), расшифровываю не больше {STT_MAX_SECONDS:.0f} с.")
+            return
 
-        # Конвертируем файл в WAV
-        if message.video_note:
-            # Извлекаем аудио из видеосообщения
-            audio = AudioSegment.from_file(file_path, format="mp4")
-        else:
-            # Конвертируем OGG файл в WAV
-            audio = AudioSegment.from_file(file_path, format="ogg")
+        # Одинаковое аудио (пересланное или повторный /voice) отдаём из кэша без скачивания
+        cache_key = TranscriptCache.key(media.file_unique_id, STT_ENGINE, STT_LANGUAGE)
+        cached_text = await transcript_cache.get(cache_key)
+        if cached_text is not None:
+            await outbox.reply(update.message, f"Распознанный текст: {cached_text}")
+            return
 
-        wav_path = file_path.replace(".ogg", ".wav").replace(".mp4", ".wav")
-        audio.export(wav_path, format="wav")
+        # Отвечаем сразу, а результат подставим в это же сообщение, когда он будет готов
+        status_message = await outbox.reply(update.message, "Расшифровываю...")
 
-        # Используем распознавание речи
-        recognizer = sr.Recognizer()
-        with sr.AudioFile(wav_path) as source:
-            audio_data = recognizer.record(source)
-            text = recognizer.recognize_google(audio_data, language="ru-RU")
+        try:
+            position = await submit_transcription(context, VoiceTranscriber.job(media, cache_key, status_message))
+        except QueueFull:
+            await outbox.edit(context.bot, status_message.chat_id, status_message.message_id,
+                              "Слишком много голосовых в очереди, попробуйте позже.")
+            return
 
-        await update.message.reply_text(f"Распознанный текст: {text}")
+        if position:
+            await outbox.edit(context.bot, status_message.chat_id, status_message.message_id,
+                              f"В очереди на расшифровку, позиция {position}", wait=False)
 
     except Exception as e:
         logging.error(f"Ошибка при расшифровке голосового сообщения: {e}")
-        await update.message.reply_text("Произошла ошибка при расшифровке голосового сообщения.")
+        await outbox.reply(update.message, "Произошла ошибка при расшифровке голосового сообщения.")
 
-    finally:
-        # Удаляем временные файлы, если они существуют
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-        if wav_path and os.path.exists(wav_path):
-            os.remove(wav_path)
+
+# Ставит расшифровку в очередь этого процесса или брокера; возвращает позицию в очереди
+async def submit_transcription(context: ContextTypes.DEFAULT_TYPE, job) -> int:
+    if job_broker is None:
+        return transcription_queue.submit(lambda: voice_transcriber.run(context.bot, job))
+    if await asyncio.to_thread(job_broker.depth, ["transcribe"]) >= transcription_queue.max_depth:
+        raise QueueFull()
+    return await asyncio.to_thread(job_broker.enqueue, "transcribe", job)
+
+
+# Задача получения имён для обработчиков; не чаще раза в NAME_JOB_INTERVAL секунд на чат
+async def submit_name_job(chat_id, missing) -> None:
+    now = time.monotonic()
+    if name_jobs.get(chat_id, 0.0) > now:
+        return
+    if len(name_jobs) > 1024:
+        for stale_chat in [key for key, until in name_jobs.items() if until <= now]:
+            del name_jobs[stale_chat]
+    name_jobs[chat_id] = now + NAME_JOB_INTERVAL
+    await asyncio.to_thread(job_broker.enqueue, "resolve_names",
+                            {"chat_id": chat_id, "user_ids": [member.id for member in missing]})
+
+
+# Перечитывает чаты, которые изменили обработчики. Пока идёт синхронизация, запись не идёт:
+# ещё не записанные изменения этого процесса (pending_keys) не перетираются данными из хранилища
+async def sync_shared_members(context: ContextTypes.DEFAULT_TYPE) -> None:
+    global shared_seq
+    try:
+        seq, chat_ids = await asyncio.to_thread(storage.changes_since, shared_seq)
+        if chat_ids is None:
+            chat_ids = chat_data.chat_ids()
+        async with persistence.paused():
+            for chat_id in chat_ids:
+                if not chat_data.loaded(chat_id):
+                    chat_data.forget(chat_id)
+                    continue
+                items = await asyncio.to_thread(storage.load_chat, chat_id)
+                keep = {user_id for key_chat, user_id in persistence.pending_keys() if key_chat == chat_id}
+                chat_data.refresh(chat_id, items, keep)
+                roster_cache.invalidate(chat_id)
+        shared_seq = seq
+    except Exception as e:
+        logging.error(f"Ошибка при синхронизации участников с обработчиками: {e}")
 
 
 # Функция для команды /eball, которая отвечает на сообщение
 async def eball(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        # Проверяем, является ли это сообщение накопившимся
-        message_time = update.message.date
-        if message_time < bot_start_time:
-            logging.info(f"Игнорируем накопившееся /eball сообщение от {update.message.from_user.first_name}")
-            return
-
         # Проверяем, есть ли сообщение, на которое отвечает бот
         if update.message.reply_to_message:
             # Получаем текст сообщения, на которое бот отвечает
@@ -443,15 +721,15 @@ async def eball(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             response = random.choice(magic_8_ball_responses)
 
             # Отправляем ответ, прикрепленный к оригинальному сообщению
-            await update.message.reply_text(f"{response}",
-                                            reply_to_message_id=update.message.reply_to_message.message_id)
+            await outbox.reply(update.message, f"{response}",
+                               reply_to_message_id=update.message.reply_to_message.message_id)
         else:
             # Если команда не была ответом на сообщение, сообщаем об этом
-            await update.message.reply_text("Команда /eball должна быть ответом на сообщение.")
+            await outbox.reply(update.message, "Команда /eball должна быть ответом на сообщение.")
 
     except Exception as e:
         logging.error(f"Ошибка при выполнении команды /eball: {e}")
-        await update.message.reply_text("Произошла ошибка при выполнении команды.")
+        await outbox.reply(update.message, "Произошла ошибка при выполнении команды.")
 
 async def roll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -461,13 +739,7 @@ async def roll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         # Проверяем, активен ли бот
         if not bot_active:
-            await update.message.reply_text("Бот временно неактивен. Попробуйте позже.")
-            return
-
-        # Проверяем, является ли это сообщение накопившимся
-        message_time = update.message.date
-        if message_time < bot_start_time:
-            logging.info(f"Игнорируем накопившееся /eball сообщение от {update.message.from_user.first_name}")
+            await outbox.reply(update.message, "Бот временно неактивен. Попробуйте позже.")
             return
 
         # Получаем текст сообщения пользователя
@@ -480,10 +752,10 @@ async def roll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             if '-' in range_part:
                 start, end = map(int, range_part.split('-'))
                 if start > end:
-                    await update.message.reply_text("Ошибка: начальное число должно быть меньше конечного.")
+                    await outbox.reply(update.message, "Ошибка: начальное число должно быть меньше конечного.")
                     return
             else:
-                await update.message.reply_text("Неверный формат диапазона. Используйте /roll X-Y.")
+                await outbox.reply(update.message, "Неверный формат диапазона. Используйте /roll X-Y.")
                 return
         else:
             # Если диапазон не указан, используем значения по умолчанию
@@ -493,104 +765,258 @@ async def roll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         random_number = random.randint(start, end)
 
         # Отправляем результат пользователю
-        await update.message.reply_text(f"{random_number}")
+        await outbox.reply(update.message, f"{random_number}")
     except ValueError:
-        await update.message.reply_text("Ошибка: убедитесь, что вы ввели числа в правильном формате(/roll X-Y)")
+        await outbox.reply(update.message, "Ошибка: убедитесь, что вы ввели числа в правильном формате(/roll X-Y)")
     except Exception as e:
         logging.error(f"Ошибка при выполнении команды /roll: {e}")
-        await update.message.reply_text("Произошла ошибка. Попробуйте снова.")
+        await outbox.reply(update.message, "Произошла ошибка. Попробуйте снова.")
 
 async def set_nickname(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logging.info("nickname")
     try:
-        # Проверяем, является ли это сообщение накопившимся
-        message_time = update.message.date
-        if message_time < bot_start_time:
-            logging.info(f"Игнорируем накопившееся /nickname сообщение от {update.message.from_user.first_name}")
-            return
-
         chat_id = str(update.effective_chat.id)
         user = update.message.from_user
 
         # Проверяем, есть ли пользователь в списке участников
         if chat_id not in chat_data:
-            await update.message.reply_text("Нет данных о чате.")
+            await outbox.reply(update.message, "Нет данных о чате.")
             return
 
         # Находим пользователя в chat_data
-        user_entry = None
-        for member in chat_data[chat_id]:
-            if member["id"] == user.id:
-                user_entry = member
-                break
+        user_entry = chat_data.get(chat_id, user.id)
 
         if not user_entry:
-            await update.message.reply_text("Вы не зарегистрированы в системе.")
+            await outbox.reply(update.message, "Вы не зарегистрированы в системе.")
             return
 
         # Проверяем, имеет ли пользователь право на установку никнейма
-        if user_entry.get("isAdmin", 0) != 1:
-            await update.message.reply_text("Ты хуй без прав")
+        if user_entry.is_admin != 1:
+            await outbox.reply(update.message, "Ты хуй без прав")
             return
 
         # Проверяем, что команда — ответ на другое сообщение
         if not update.message.reply_to_message:
-            await update.message.reply_text("Эта команда должна быть ответом на сообщение.")
+            await outbox.reply(update.message, "Эта команда должна быть ответом на сообщение.")
             return
 
         target_user = update.message.reply_to_message.from_user
         nickname_match = context.args
 
         if not nickname_match:
-            await update.message.reply_text("Укажите никнейм")
+            await outbox.reply(update.message, "Укажите никнейм")
             return
 
         new_nickname = " ".join(nickname_match)
 
         # Ищем целевого пользователя в chat_data
-        target_found = False
-        for member in chat_data[chat_id]:
-            if member["id"] == target_user.id:
-                member["nickname"] = new_nickname
-                target_found = True
-                break
-
-        if not target_found:
-            await update.message.reply_text("Целевой пользователь не найден в базе.")
+        target_member = chat_data.get(chat_id, target_user.id)
+        if target_member is None:
+            await outbox.reply(update.message, "Целевой пользователь не найден в базе.")
             return
 
-        # Сохраняем обновлённые данные
-        save_data()
+        target_member.nickname = new_nickname
 
-        await update.message.reply_text(f"Пользователю {target_user.first_name} установлен никнейм: {new_nickname}")
+        # Помечаем обновлённые данные к сохранению
+        save_data(chat_id, target_member.id)
+
+        await outbox.reply(update.message, f"Пользователю {target_user.first_name} установлен никнейм: {new_nickname}")
 
     except Exception as e:
         logging.error(f"Ошибка при выполнении команды /nickname: {e}")
-        await update.message.reply_text("Произошла ошибка при изменении никнейма.")
+        await outbox.reply(update.message, "Произошла ошибка при изменении никнейма.")
 
-async def main() -> None:
+# Участники чата подгружаются из хранилища в потоке до обработчиков, которые читают их синхронно
+async def preload_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat = update.effective_chat
+    if chat is not None:
+        try:
+            await chat_data.preload(str(chat.id))
+        except Exception as e:
+            logging.error(f"Ошибка при загрузке участников чата {chat.id}: {e}")
+
+
+# Накопившиеся обновления отсеиваются до всех обработчиков
+async def drop_stale_updates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if stale_filter.is_stale(update):
+        raise ApplicationHandlerStop
+
+
+# Отчёт о холодном старте: время каждого этапа до первого обработанного обновления
+async def report_startup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if startup_marks[-1][0] == "first_update":
+        return
+    startup_marks.append(("first_update", time.perf_counter()))
+    phases = ", ".join(
+        f"{name} {(mark - previous) * 1000:.0f} мс"
+        for (_, previous), (name, mark) in zip(startup_marks, startup_marks[1:])
+    )
+    total = (startup_marks[-1][1] - startup_marks[0][1]) * 1000
+    logging.info(f"Холодный старт до первого обновления: {total:.0f} мс ({phases})")
+
+
+# Сообщения обработчиков из других процессов уходят через outbox этого процесса,
+# чтобы темп по чатам был общим
+async def relay_outbound(bot) -> None:
+    while True:
+        try:
+            job = await asyncio.to_thread(job_broker.claim, RELAY_ID, [OUTBOUND])
+            if job is None:
+                await asyncio.sleep(RELAY_INTERVAL)
+                continue
+            await RelayedOutbox.deliver(outbox, bot, job["payload"])
+            await asyncio.to_thread(job_broker.complete, job["id"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка при пересылке сообщения обработчика: {e}")
+            await asyncio.sleep(RELAY_INTERVAL)
+
+
+# Запуск фоновой записи данных и очереди расшифровки
+async def on_startup(app) -> None:
+    global relay_task
+    await outbox.start()
+    await confirmations.start(lambda expired: expire_confirmations(app.bot, expired))
+    await persistence.start()
+    await transcription_queue.start()
+    if job_broker is not None:
+        relay_task = asyncio.create_task(relay_outbound(app.bot))
+
+
+# Дожидаемся уже принятых расшифровок и сбрасываем несохранённые данные при остановке
+async def on_shutdown(app) -> None:
+    await transcription_queue.drain(SHUTDOWN_TIMEOUT)
+    await transcription_queue.stop()
+    await confirmations.stop()
+    if relay_task is not None:
+        relay_task.cancel()
+        await asyncio.gather(relay_task, return_exceptions=True)
+    await outbox.stop(SHUTDOWN_TIMEOUT)
+    stale_filter.flush()
+    await persistence.stop()
+    logging.info(f"Кэш расшифровок: {transcript_cache.stats()}")
+    transcript_cache.close()
+    if job_broker is not None:
+        job_broker.close()
+    storage.close()
+
+
+# Создаёт приложение и регистрирует обработчики
+def build_application(token=TELEGRAM_TOKEN, base_url=None, base_file_url=None):
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest(connection_pool_size=1))
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    app = builder.build()
+    startup_marks.append(("build", time.perf_counter()))
+
+    # Регистрируем обработчики (каждый обёрнут в замер времени и ошибок).
+    # Дорогие команды ограничены по частоте: Limit(сколько подряд, за сколько секунд восстанавливается)
+    app.add_handler(TypeHandler(Update, preload_chat), group=-3)
+    app.add_handler(TypeHandler(Update, drop_stale_updates), group=-2)
+    app.add_handler(TypeHandler(Update, report_startup), group=-1)
+    app.add_handler(CommandHandler("tag_all", instrument("tag_all", rate_limiter.limit(
+        "tag_all", tag_all, per_user=Limit(2, 600), per_chat=Limit(3, 600), debounce=15))))
+    app.add_handler(CommandHandler("check_all", instrument("check_all", rate_limiter.limit(
+        "check_all", check_all, per_user=Limit(3, 60), per_chat=Limit(5, 60), debounce=5))))  # Добавляем обработчик команды /check_all
+    app.add_handler(CommandHandler("voice", instrument("transcribe_voice", rate_limiter.limit(
+        "voice", transcribe_voice, total=Limit(60, 60), per_user=Limit(3, 60), per_chat=Limit(10, 60)))))  # Добавляем обработчик команды /voice
+    app.add_handler(CommandHandler("eball", instrument("eball", eball)))  # Добавляем обработчик команды /eball
+    app.add_handler(CommandHandler("roll", instrument("roll", roll)))  # Добавляем обработчик команды /roll
+    app.add_handler(CommandHandler("nick", instrument("set_nickname", set_nickname)))
+    app.add_handler(MessageHandler(filters.VOICE, instrument("voice_handler", rate_limiter.limit(
+        "voice_message", voice_handler, per_user=Limit(10, 60), per_chat=Limit(30, 60)))))  # Добавляем обработчик голосовых сообщений
+    app.add_handler(MessageHandler(filters.ALL, instrument("handle_message", handle_message)))  # Обрабатываем все сообщения
+    app.add_handler(CallbackQueryHandler(instrument("handle_tag_confirmation", handle_tag_confirmation)))
+    app.add_handler(ChatMemberHandler(instrument("handle_chat_member", handle_chat_member),
+                                      ChatMemberHandler.CHAT_MEMBER))
+    app.add_handler(ChatMemberHandler(instrument("handle_my_chat_member", handle_my_chat_member),
+                                      ChatMemberHandler.MY_CHAT_MEMBER))
+
+    # Горячая перезагрузка правил ключевых слов
+    app.job_queue.run_repeating(reload_keyword_rules, KEYWORDS_RELOAD_INTERVAL)
+    if ROSTER_SYNC_INTERVAL:
+        app.job_queue.run_repeating(sync_roster, ROSTER_SYNC_INTERVAL, first=ROSTER_SYNC_INTERVAL)
+    if SHARED_STATE:
+        app.job_queue.run_repeating(sync_shared_members, SHARED_STATE_INTERVAL, first=SHARED_STATE_INTERVAL)
+
+    return app
+
+
+# Запускает приложение в выбранном режиме и работает до SIGTERM/SIGINT.
+# При остановке сначала перестаём принимать обновления, затем дорабатываем принятые
+async def run_bot(app, stop_event=None) -> None:
     global bot_active, bot_start_time
 
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    webhook_server = None
+    metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT) if METRICS_PORT else None
+    async with app:
+        await on_startup(app)
+        try:
+            if metrics_server is not None:
+                await metrics_server.start()
+            await app.start()
+
+            if RUN_MODE == "webhook":
+                from webhook import WebhookServer
+
+                webhook_server = WebhookServer(app, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET)
+                await webhook_server.start()
+                if WEBHOOK_URL:
+                    await app.bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                                              drop_pending_updates=STALE_UPDATE_POLICY == "drop",
+                                              allowed_updates=Update.ALL_TYPES)
+            elif RUN_MODE == "polling":
+                # Накопившиеся сообщения сбрасываются только с политикой drop.
+                # chat_member Telegram присылает, только если запросить его явно (allowed_updates)
+                await app.updater.start_polling(drop_pending_updates=STALE_UPDATE_POLICY == "drop",
+                                                allowed_updates=Update.ALL_TYPES)
+            else:
+                raise ValueError(f"Неизвестный режим запуска: {RUN_MODE}")
+
+            # Устанавливаем флаг активности бота и время старта
+            bot_active = True
+            bot_start_time = datetime.now(timezone.utc)
+            stale_filter.started_at = bot_start_time
+            startup_marks.append(("ready", time.perf_counter()))
+            logging.info(f"Бот запущен за {(startup_marks[-1][1] - startup_marks[0][1]) * 1000:.0f} мс")
+
+            await stop_event.wait()
+            logging.info("Получен сигнал остановки, дорабатываем принятые обновления")
+            bot_active = False
+        finally:
+            if webhook_server is not None:
+                await webhook_server.stop()
+            if app.updater.running:
+                await app.updater.stop()
+            if app.running:
+                # Application.stop() дожидается обработки уже принятых обновлений
+                await app.stop()
+            if metrics_server is not None:
+                await metrics_server.stop()
+            if metrics.slow_traces is not None:
+                logging.info(f"Самые медленные вызовы обработчиков:\n{metrics.slow_traces.dump()}")
+            await on_shutdown(app)
+
+
+async def main() -> None:
     try:
-        # Замените 'YOUR_TOKEN_HERE' на токен вашего бота
-        app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-
-        # Регистрируем обработчики
-        app.add_handler(CommandHandler("tag_all", tag_all))
-        app.add_handler(CommandHandler("check_all", check_all))  # Добавляем обработчик команды /check_all
-        app.add_handler(CommandHandler("voice", transcribe_voice))  # Добавляем обработчик команды /voice
-        app.add_handler(CommandHandler("eball", eball))  # Добавляем обработчик команды /eball
-        app.add_handler(CommandHandler("roll", roll))  # Добавляем обработчик команды /roll
-        app.add_handler(CommandHandler("nick", set_nickname))
-        app.add_handler(MessageHandler(filters.VOICE, voice_handler))  # Добавляем обработчик голосовых сообщений
-        app.add_handler(MessageHandler(filters.ALL, handle_message))  # Обрабатываем все сообщения
-        app.add_handler(CallbackQueryHandler(handle_tag_confirmation))
-        # Устанавливаем флаг активности бота и время старта
-        bot_active = True
-        bot_start_time = datetime.now(timezone.utc)
-
-        # Запускаем бота без сброса накопившихся сообщений
-        await app.run_polling(drop_pending_updates=False)
+        app = build_application(base_url=TELEGRAM_API_URL, base_file_url=TELEGRAM_FILE_URL)
+        await run_bot(app)
     except Exception as e:
         logging.error(f"Ошибка в основном цикле бота: {e}")
 
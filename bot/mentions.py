@@ -0,0 +1,35 @@
+import html
+
+# Ограничение Telegram на длину текста сообщения (в UTF-16 символах)
+MESSAGE_LIMIT = 4096
+# Имена длиннее этого значения обрезаются, чтобы одно упоминание всегда помещалось в сообщение
+NAME_LIMIT = 64
+
+
+def utf16_length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+# Упоминание участника в HTML-разметке; имя экранируется
+def format_mention(user_id, name) -> str:
+    return f'<a href="tg://user?id={user_id}">{html.escape(name[:NAME_LIMIT])}</a>'
+
+
+# Разбивает упоминания на сообщения не длиннее max_length и не больше max_mentions упоминаний в каждом.
+# members — пары (user_id, display_name)
+def build_mention_chunks(members, max_length=MESSAGE_LIMIT, max_mentions=50) -> list:
+    chunks = []
+    current = []
+    current_length = 0
+    for user_id, name in members:
+        mention = format_mention(user_id, name)
+        length = utf16_length(mention) + 1  # плюс разделитель
+        if current and (current_length + length > max_length or len(current) >= max_mentions):
+            chunks.append(" ".join(current))
+            current = []
+            current_length = 0
+        current.append(mention)
+        current_length += length
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
@@ -0,0 +1,341 @@
+import cProfile
+import functools
+import heapq
+import io
+import itertools
+import logging
+import pstats
+import time
+import types
+
+from telegram.request import HTTPXRequest
+
+import logsetup
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1.0) -> None:
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge(Counter):
+    def dec(self, *label_values, amount=1.0) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value) -> None:
+        self._values[label_values] = value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for label_values, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class CallbackGauge:
+    """Значение считается в момент выдачи /metrics (например, длина очереди)."""
+
+    TYPE = "gauge"
+
+    def __init__(self, name, help, callback):
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.TYPE}"
+        try:
+            yield f"{self.name} {float(self.callback())}"
+        except Exception as e:
+            logging.error(f"Ошибка при расчёте метрики {self.name}: {e}")
+
+
+class CallbackCounter(CallbackGauge):
+    """То же для значений, которые только растут (попадания в кэш, отказы): тип counter, имя на _total."""
+
+    TYPE = "counter"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, *label_values, value) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            # Счётчики по корзинам (последняя — +Inf), сумма и количество
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        counts = series[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                labels = _format_labels((*self.labels, "le"), (*label_values, bound))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HANDLER_LATENCY = registry.register(
+    Histogram("bot_handler_duration_seconds", "Время выполнения обработчика", labels=("handler",))
+)
+HANDLER_IN_FLIGHT = registry.register(
+    Gauge("bot_handler_in_flight", "Обработчики, выполняющиеся сейчас", labels=("handler",))
+)
+HANDLER_ERRORS = registry.register(
+    Counter("bot_handler_errors_total", "Ошибки в обработчиках: записи лога ERROR и необработанные исключения",
+            labels=("handler",))
+)
+API_LATENCY = registry.register(
+    Histogram("bot_api_request_duration_seconds", "Время запроса к Bot API", labels=("method",))
+)
+API_ERRORS = registry.register(
+    Counter("bot_api_request_errors_total", "Ошибки запросов к Bot API", labels=("method",))
+)
+
+
+class SlowTraceRecorder:
+    """
+    Профилирование обработчиков (включается отдельно, заметно замедляет работу).
+    Хранит keep самых медленных вызовов с выводом pstats.
+    Профиль включается только на синхронных участках самого обработчика (между await),
+    поэтому код других задач цикла событий в него не попадает; длительность вызова при этом —
+    полное время вместе с ожиданием. Одновременно профилируется только один вызов:
+    cProfile не поддерживает вложенные профили.
+    """
+
+    def __init__(self, keep=10, lines=25):
+        self.keep = keep
+        self.lines = lines
+        self._heap = []
+        self._counter = itertools.count()
+        self._active = False
+
+    def begin(self):
+        if self._active:
+            return None
+        self._active = True
+        return cProfile.Profile()
+
+    def end(self, profiler, handler_name, duration) -> None:
+        profiler.disable()
+        self._active = False
+        if len(self._heap) >= self.keep and duration <= self._heap[0][0]:
+            return
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(self.lines)
+        entry = (duration, next(self._counter), handler_name, stream.getvalue())
+        if len(self._heap) >= self.keep:
+            heapq.heapreplace(self._heap, entry)
+        else:
+            heapq.heappush(self._heap, entry)
+
+    def dump(self) -> str:
+        parts = []
+        for duration, _, handler_name, trace in sorted(self._heap, reverse=True):
+            parts.append(f"=== {handler_name}: {duration:.3f} с ===\n{trace}")
+        return "\n".join(parts)
+
+
+slow_traces = None
+
+# Дополнительные получатели точных замеров (имя обработчика, секунды), например для бенчмарка
+latency_observers = []
+
+
+# Выполняет корутину, включая профиль только на время её шагов: пока она ждёт (await),
+# цикл событий выполняет чужие задачи, и их время в профиль не попадает
+@types.coroutine
+def _profiled(coroutine, profiler):
+    value, error = None, None
+    while True:
+        profiler.enable()
+        try:
+            if error is not None:
+                awaited = coroutine.throw(error)
+            else:
+                awaited = coroutine.send(value)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            profiler.disable()
+        try:
+            value, error = (yield awaited), None
+        except BaseException as e:
+            value, error = None, e
+
+
+class ErrorLogCounter(logging.Handler):
+    """
+    Считает записи лога уровня ERROR по обработчикам (имя берётся из контекста logsetup).
+    Обработчики ловят исключения сами и пишут logging.error, поэтому без этого
+    bot_handler_errors_total видел бы только исключения, вылетевшие из обработчика.
+    """
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+
+    def emit(self, record) -> None:
+        handler = logsetup.current_handler.get()
+        if handler is not None:
+            HANDLER_ERRORS.inc(handler)
+
+
+# Подключение подсчёта ошибок к корневому логгеру (после настройки логирования)
+def count_logged_errors() -> None:
+    logging.getLogger().addHandler(ErrorLogCounter())
+
+
+# Включение профилирования самых медленных вызовов обработчиков
+def enable_profiling(keep=10) -> None:
+    global slow_traces
+    slow_traces = SlowTraceRecorder(keep=keep)
+
+
+# Обёртка обработчика: время выполнения, число выполняющихся и ошибки
+def instrument(name, handler):
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        # Записи лога из обработчика помечаются его именем и чатом обновления
+        chat = getattr(args[0], "effective_chat", None) if args else None
+        log_context = logsetup.bind(name, chat.id if chat is not None else None)
+        HANDLER_IN_FLIGHT.inc(name)
+        profiler = slow_traces.begin() if slow_traces is not None else None
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                return await _profiled(handler(*args, **kwargs), profiler)
+            return await handler(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            HANDLER_LATENCY.observe(name, value=duration)
+            for observer in latency_observers:
+                observer(name, duration)
+            HANDLER_IN_FLIGHT.dec(name)
+            if profiler is not None:
+                slow_traces.end(profiler, name, duration)
+            logsetup.reset(log_context)
+
+    return wrapper
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTP-клиент Bot API, который замеряет время каждого метода."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        # Скачивание файлов идёт по адресу с путём файла — сводим их в одну метку
+        api_method = "downloadFile" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            if code >= 400:
+                API_ERRORS.inc(api_method)
+            return code, payload
+        except Exception:
+            API_ERRORS.inc(api_method)
+            raise
+        finally:
+            API_LATENCY.observe(api_method, value=time.perf_counter() - start)
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер: /metrics в текстовом формате Prometheus и /debug/slow с профилями."""
+
+    def __init__(self, listen="127.0.0.1", port=9100):
+        self.listen = listen
+        self.port = port
+        self._runner = None
+
+    async def start(self) -> None:
+        # aiohttp нужен только при включённых метриках — не тянем его при старте
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        app.router.add_get("/debug/slow", self._slow)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logging.info(f"Метрики доступны на {self.listen}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _metrics(self, request):
+        from aiohttp import web
+
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def _slow(self, request):
+        from aiohttp import web
+
+        if slow_traces is None:
+            return web.Response(status=404, text="Профилирование выключено (PROFILE_HANDLERS)")
+        return web.Response(text=slow_traces.dump(), content_type="text/plain", charset="utf-8")
@@ -0,0 +1,100 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import tempfile
+
+
+# Атомарная запись JSON: пишем во временный файл рядом и переименовываем
+def atomic_write_json(path, payload) -> None:
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(payload, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class WriteBehind:
+    """
+    Отложенная запись состояния.
+    Обработчики только помечают изменения через mark_dirty(), а фоновая задача
+    сбрасывает их по таймеру или при накоплении max_pending изменений.
+    snapshot(keys) вызывается в цикле событий и должен вернуть независимую копию данных,
+    write(payload) выполняется в отдельном потоке и не блокирует обработчики.
+    """
+
+    def __init__(self, snapshot, write, interval=5.0, max_pending=100):
+        self._snapshot = snapshot
+        self._write = write
+        self.interval = interval
+        self.max_pending = max_pending
+        self._dirty = set()
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._stopping = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    # Помечаем ключ как изменённый; повторные изменения одного ключа сливаются
+    def mark_dirty(self, key=None) -> None:
+        self._dirty.add(key)
+        if len(self._dirty) >= self.max_pending:
+            self._wakeup.set()
+
+    # Ключи, ещё не записанные в хранилище
+    def pending_keys(self) -> set:
+        return set(self._dirty)
+
+    # Пока внутри блока, сброс не идёт: всё, что не записано, видно в pending_keys()
+    @contextlib.asynccontextmanager
+    async def paused(self):
+        async with self._lock:
+            yield
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    # Останавливаем фоновую задачу и обязательно сбрасываем остаток
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._dirty:
+                return
+            keys, self._dirty = self._dirty, set()
+            payload = self._snapshot(keys)
+            try:
+                await asyncio.to_thread(self._write, payload)
+            except Exception as e:
+                # Возвращаем ключи, чтобы не потерять изменения при следующей попытке
+                self._dirty |= keys
+                logging.error(f"Ошибка при сохранении данных: {e}")
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
@@ -0,0 +1,167 @@
+import asyncio
+import functools
+import logging
+import math
+import time
+
+
+class Limit:
+    """Бюджет токен-бакета: burst запросов подряд, полностью восстанавливается за per секунд."""
+
+    __slots__ = ("burst", "per")
+
+    def __init__(self, burst, per):
+        self.burst = burst
+        self.per = per
+
+    @property
+    def rate(self) -> float:
+        return self.burst / self.per
+
+
+class _Bucket:
+    __slots__ = ("limit", "tokens", "updated", "warned")
+
+    def __init__(self, limit, updated):
+        self.limit = limit
+        self.tokens = limit.burst
+        self.updated = updated
+        self.warned = False
+
+    def refill(self, now) -> float:
+        self.tokens = min(self.limit.burst, self.tokens + (now - self.updated) * self.limit.rate)
+        self.updated = now
+        return self.tokens
+
+
+class RateLimiter:
+    """
+    Ограничение частоты команд токен-бакетами: отдельно на команду в целом, на пользователя
+    и на чат. Полный бакет ничем не отличается от отсутствующего, поэтому такие бакеты
+    периодически удаляются — в памяти остаются только ещё не восстановившиеся.
+    Одинаковые команды в одном чате, пришедшие, пока первая выполняется (или в течение
+    debounce секунд после неё), объединяются: обработчик выполняется один раз. Если он вернул
+    отправленное сообщение с ответом, повторы получают его текст, иначе — короткую отсылку
+    к ответу выше. Повторы тоже расходуют бюджет, так что ответы на них ограничены лимитами.
+    """
+
+    DUPLICATE_NOTE = "Эта команда только что выполнялась в этом чате — ответ выше."
+
+    def __init__(self, enabled=True, sweep_interval=60.0, notify=None):
+        self.enabled = enabled
+        self.notify = notify
+        self.sweep_interval = sweep_interval
+        self.rejected = 0
+        self.merged = 0
+        self._buckets = {}
+        self._merges = {}
+        self._last_sweep = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        return len(self._buckets)
+
+    # Списывает по токену из всех бакетов; возвращает (0, None) или (секунды ожидания, пустой бакет)
+    def acquire(self, checks, now=None):
+        now = time.monotonic() if now is None else now
+        if now - self._last_sweep >= self.sweep_interval:
+            self._sweep(now)
+
+        buckets = []
+        wait, blocked = 0.0, None
+        for key, limit in checks:
+            bucket = self._buckets.get(key)
+            if bucket is None or bucket.limit is not limit:
+                bucket = self._buckets[key] = _Bucket(limit, now)
+            elif bucket.refill(now) < 1 and (1 - bucket.tokens) / limit.rate > wait:
+                wait, blocked = (1 - bucket.tokens) / limit.rate, bucket
+            buckets.append(bucket)
+
+        if blocked is not None:
+            return wait, blocked
+        for bucket in buckets:
+            bucket.tokens -= 1
+            bucket.warned = False
+        return 0.0, None
+
+    def _sweep(self, now) -> None:
+        self._last_sweep = now
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if bucket.refill(now) < bucket.limit.burst
+        }
+        self._merges = {
+            key: (future, expires) for key, (future, expires) in self._merges.items()
+            if not future.done() or expires > now
+        }
+
+    # Обёртка обработчика команды: лимиты задаются при регистрации в build_application()
+    def limit(self, name, handler, total=None, per_user=None, per_chat=None, debounce=None):
+        if not self.enabled:
+            return handler
+
+        @functools.wraps(handler)
+        async def wrapper(update, context, *args, **kwargs):
+            chat_id = update.effective_chat.id if update.effective_chat else None
+            user_id = update.effective_user.id if update.effective_user else None
+            now = time.monotonic()
+
+            checks = []
+            if total is not None:
+                checks.append(((name,), total))
+            if per_user is not None and user_id is not None:
+                checks.append(((name, "user", user_id), per_user))
+            if per_chat is not None and chat_id is not None:
+                checks.append(((name, "chat", chat_id), per_chat))
+            wait, bucket = self.acquire(checks, now)
+            if bucket is not None:
+                self.rejected += 1
+                # Предупреждаем один раз, пока бакет не восстановится, чтобы не спамить в ответ
+                if not bucket.warned and update.effective_message is not None:
+                    bucket.warned = True
+                    text = f"Слишком часто. Попробуйте через {math.ceil(wait)} с."
+                    try:
+                        if self.notify is not None:
+                            await self.notify(update.effective_message, text)
+                        else:
+                            await update.effective_message.reply_text(text)
+                    except Exception as e:
+                        logging.error(f"Ошибка при отправке предупреждения о лимите: {e}")
+                return None
+
+            if debounce is None:
+                return await handler(update, context, *args, **kwargs)
+
+            merge_key = (name, chat_id)
+            merge = self._merges.get(merge_key)
+            if merge is not None and (not merge[0].done() or merge[1] > now):
+                self.merged += 1
+                result = await asyncio.shield(merge[0])
+                await self._answer_duplicate(update, result)
+                return result
+
+            future = asyncio.get_running_loop().create_future()
+            self._merges[merge_key] = (future, math.inf)
+            result = None
+            try:
+                result = await handler(update, context, *args, **kwargs)
+                return result
+            finally:
+                future.set_result(result)
+                self._merges[merge_key] = (future, time.monotonic() + debounce)
+
+        return wrapper
+
+    # Повтору — текст ответа первой команды или отсылка к нему
+    async def _answer_duplicate(self, update, result) -> None:
+        message = update.effective_message
+        if message is None:
+            return
+        text = getattr(result, "text", None) or self.DUPLICATE_NOTE
+        try:
+            if self.notify is not None:
+                await self.notify(message, text)
+            else:
+                await message.reply_text(text)
+        except Exception as e:
+            logging.error(f"Ошибка при ответе на повторную команду: {e}")
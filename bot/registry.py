@@ -0,0 +1,168 @@
+import asyncio
+from collections import OrderedDict
+
+
+class Member:
+    """Участник чата. __slots__ вместо dict: меньше памяти на запись и быстрее доступ к полям."""
+
+    __slots__ = ("id", "first_name", "nickname", "is_admin")
+
+    def __init__(self, id, first_name=None, nickname="", is_admin=0):
+        self.id = id
+        self.first_name = first_name
+        self.nickname = nickname
+        self.is_admin = is_admin
+
+    # Имя для отображения: никнейм, если задан, иначе first_name
+    @property
+    def display_name(self):
+        return self.nickname if self.nickname else self.first_name
+
+    # Преобразование в формат active_users.json
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "first_name": self.first_name,
+            "nickname": self.nickname,
+            "isAdmin": self.is_admin,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Member":
+        return cls(
+            data["id"],
+            data.get("first_name"),
+            data.get("nickname", ""),
+            data.get("isAdmin", 0),
+        )
+
+
+class MemberRegistry:
+    """
+    Реестр участников по чатам с поиском за O(1) по (chat_id, user_id).
+    Внутри — dict chat_id -> dict user_id -> Member; словари сохраняют порядок вставки,
+    поэтому порядок обхода участников стабилен и совпадает с порядком в файле.
+    Если задан loader(chat_id), чаты подгружаются из хранилища при первом обращении;
+    preload() делает это в потоке, не блокируя цикл событий. Чтение не создаёт записей:
+    чат без участников запоминается только в коротком списке пустых (max_absent),
+    а словарь чата появляется при первом add(). Если хранилище общее с другими процессами,
+    их изменения применяются через refresh() и forget().
+    """
+
+    def __init__(self, loader=None, max_absent=1024):
+        self._chats = {}
+        self._loader = loader
+        self._absent = OrderedDict()
+        self.max_absent = max_absent
+
+    def __contains__(self, chat_id) -> bool:
+        return bool(self._chat(chat_id))
+
+    # Чаты, уже загруженные в память
+    def chat_ids(self):
+        return [chat_id for chat_id, members in self._chats.items() if members]
+
+    # Участники чата; create=False — чтение: пустой чат не заводится в реестре
+    def _chat(self, chat_id, create=False) -> dict:
+        members = self._chats.get(chat_id)
+        if members is not None:
+            return members
+        if chat_id not in self._absent and self._loader is not None:
+            members = self._remember(chat_id, self._loader(chat_id))
+            if members is not None:
+                return members
+        if not create:
+            return {}
+        self._absent.pop(chat_id, None)
+        members = self._chats[chat_id] = {}
+        return members
+
+    # Загружает чат из хранилища в отдельном потоке (до обработчиков обновления)
+    async def preload(self, chat_id) -> None:
+        if chat_id in self._chats or chat_id in self._absent or self._loader is None:
+            return
+        items = await asyncio.to_thread(self._loader, chat_id)
+        # Пока шло чтение, чат мог появиться в реестре — уже загруженное не перезаписываем
+        if chat_id not in self._chats:
+            self._remember(chat_id, items)
+
+    def _remember(self, chat_id, items):
+        members = {}
+        for item in items:
+            member = Member.from_dict(item)
+            members[member.id] = member
+        if not members:
+            self._absent[chat_id] = True
+            while len(self._absent) > self.max_absent:
+                self._absent.popitem(last=False)
+            return None
+        self._chats[chat_id] = members
+        return members
+
+    def loaded(self, chat_id) -> bool:
+        return chat_id in self._chats
+
+    # Все загруженные чаты, в том числе опустевшие
+    def loaded_ids(self):
+        return list(self._chats)
+
+    # Чат изменил другой процесс: незагруженный чат при следующем обращении прочитается заново
+    def forget(self, chat_id) -> None:
+        self._absent.pop(chat_id, None)
+
+    # Обновляет загруженный чат данными из хранилища (его изменил другой процесс).
+    # Участники из keep — ещё не записанные изменения этого процесса — остаются как есть.
+    # Объекты участников обновляются на месте: обработчики могут держать на них ссылки
+    def refresh(self, chat_id, items, keep=()) -> None:
+        self._absent.pop(chat_id, None)
+        local = self._chats.get(chat_id)
+        if local is None:
+            return
+        members = {}
+        for item in items:
+            user_id = item["id"]
+            if user_id in keep:
+                continue
+            member = local.get(user_id)
+            if member is None:
+                member = Member.from_dict(item)
+            else:
+                member.first_name = item.get("first_name")
+                member.nickname = item.get("nickname", "")
+                member.is_admin = item.get("isAdmin", 0)
+            members[user_id] = member
+        for user_id in keep:
+            if user_id in local:
+                members[user_id] = local[user_id]
+        self._chats[chat_id] = members
+
+    def get(self, chat_id, user_id):
+        return self._chat(chat_id).get(user_id)
+
+    # Добавляет участника, если его ещё нет. Возвращает (участник, был_ли_добавлен)
+    def add(self, chat_id, user_id, first_name=None):
+        members = self._chat(chat_id, create=True)
+        member = members.get(user_id)
+        if member is not None:
+            return member, False
+        member = Member(user_id, first_name)
+        members[user_id] = member
+        return member, True
+
+    # Удаляет участника (вышел из чата). Возвращает удалённого участника или None
+    def remove(self, chat_id, user_id):
+        return self._chat(chat_id).pop(user_id, None)
+
+    def members(self, chat_id):
+        return list(self._chat(chat_id).values())
+
+    def count(self, chat_id) -> int:
+        return len(self._chat(chat_id))
+
+    # Загруженные чаты в формате active_users.json
+    def to_json(self) -> dict:
+        return {
+            chat_id: [member.to_dict() for member in members.values()]
+            for chat_id, members in self._chats.items()
+            if members
+        }
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import RetryAfter
+
+from sender import retry_delay
+
+
+class MemberResolver:
+    """
+    Получение имён участников через get_chat_member.
+    Запросы идут параллельно, но не больше concurrency одновременно; при ответе 429
+    все запросы ждут retry_after. Одновременные запросы одного участника объединяются,
+    результаты кэшируются на ttl секунд.
+    """
+
+    def __init__(self, concurrency=8, ttl=3600.0, max_retries=3, max_cached=10000):
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._cache = {}
+        self._inflight = {}
+        self._paused_until = 0.0
+
+    async def resolve(self, bot, chat_id, user_id):
+        key = (chat_id, user_id)
+        cached = self._cache.get(key)
+        if cached is not None:
+            name, expires = cached
+            if expires > time.monotonic():
+                return name
+            del self._cache[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(bot, chat_id, user_id))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    # Возвращает {user_id: first_name} для всех участников, которых удалось получить
+    async def resolve_many(self, bot, chat_id, user_ids) -> dict:
+        user_ids = list(user_ids)
+        results = await asyncio.gather(
+            *(self.resolve(bot, chat_id, user_id) for user_id in user_ids),
+            return_exceptions=True,
+        )
+        names = {}
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                logging.error(f"Ошибка при получении участника {user_id}: {result}",
+                              extra={"throttle": "resolve_member"})
+            elif result:
+                names[user_id] = result
+        return names
+
+    async def _fetch(self, bot, chat_id, user_id):
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                try:
+                    member = await bot.get_chat_member(chat_id, user_id)
+                except RetryAfter as e:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise
+                    delay = retry_delay(e)
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    logging.warning(f"Лимит запросов Telegram, ждём {delay} с")
+                    continue
+            name = member.user.first_name
+            now = time.monotonic()
+            if len(self._cache) >= self.max_cached:
+                # Выбрасываем просроченные записи, чтобы кэш не рос бесконечно
+                self._cache = {key: value for key, value in self._cache.items() if value[1] > now}
+            self._cache[(chat_id, user_id)] = (name, now + self.ttl)
+            return name
@@ -0,0 +1,137 @@
+import logging
+import time
+from collections import OrderedDict, deque
+
+from telegram.constants import ChatMemberStatus
+from telegram.error import Forbidden, RetryAfter
+
+
+# Состоит ли пользователь в чате (по объекту ChatMember из Telegram)
+def is_member(chat_member) -> bool:
+    if chat_member.status == ChatMemberStatus.RESTRICTED:
+        return chat_member.is_member
+    return chat_member.status not in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED)
+
+
+class RosterCache:
+    """
+    Готовые ответы /check_all по чатам и число участников чата.
+    Текст хранится вместе с числом участников, для которого он собран, и сбрасывается
+    при любом изменении участников чата (invalidate). Число участников запрашивается у Telegram
+    один раз, дальше его ведут события входа и выхода (adjust_count) и сверка RosterSync.
+    """
+
+    def __init__(self, max_chats=256):
+        self.max_chats = max_chats
+        self.hits = 0
+        self.misses = 0
+        self._texts = OrderedDict()
+        self._counts = {}
+
+    # Число участников чата: из памяти или, для незнакомого чата, одним запросом get_chat_member_count
+    async def member_count(self, bot, chat_id) -> int:
+        cached = self._counts.get(chat_id)
+        if cached is not None:
+            return cached[0]
+        count = await bot.get_chat_member_count(int(chat_id))
+        self.set_count(chat_id, count)
+        return count
+
+    def set_count(self, chat_id, count) -> None:
+        self._counts[chat_id] = (count, time.monotonic())
+
+    # Вход (+1) или выход (-1) участника; неизвестное число так и остаётся неизвестным
+    def adjust_count(self, chat_id, delta) -> None:
+        cached = self._counts.get(chat_id)
+        if cached is not None:
+            self._counts[chat_id] = (max(cached[0] + delta, 0), cached[1])
+
+    # Чаты, число участников которых не сверялось с Telegram дольше max_age секунд (самые старые первыми)
+    def stale_counts(self, max_age, limit) -> list:
+        deadline = time.monotonic() - max_age
+        stale = sorted((fetched, chat_id) for chat_id, (_, fetched) in self._counts.items() if fetched <= deadline)
+        return [chat_id for _, chat_id in stale[:limit]]
+
+    # Текст ответа, если он собран для того же числа участников чата
+    def get(self, chat_id, member_count):
+        cached = self._texts.get(chat_id)
+        if cached is None or cached[0] != member_count:
+            self.misses += 1
+            return None
+        self._texts.move_to_end(chat_id)
+        self.hits += 1
+        return cached[1]
+
+    def put(self, chat_id, member_count, text) -> None:
+        self._texts[chat_id] = (member_count, text)
+        self._texts.move_to_end(chat_id)
+        while len(self._texts) > self.max_chats:
+            self._texts.popitem(last=False)
+
+    def invalidate(self, chat_id) -> None:
+        self._texts.pop(chat_id, None)
+
+    # Сброс числа участников (например, бота удалили из чата или добавили снова)
+    def invalidate_count(self, chat_id) -> None:
+        self._counts.pop(chat_id, None)
+
+
+class RosterSync:
+    """
+    Медленная фоновая сверка участников с Telegram — на случай пропущенных событий входа и выхода
+    (бот не администратор, простой, удалённые аккаунты). За один вызов run_once проверяется
+    не больше batch участников, по кругу по всем загруженным чатам, и не больше batch чисел
+    участников, которые не сверялись дольше count_age секунд. Ушедшие удаляются из реестра,
+    сменившиеся имена обновляются; о каждом изменении сообщается через on_change(chat_id, user_id).
+    """
+
+    def __init__(self, registry, cache, on_change, batch=20, count_age=3600.0):
+        self.registry = registry
+        self.cache = cache
+        self.on_change = on_change
+        self.batch = batch
+        self.count_age = count_age
+        self.removed = 0
+        self._pending = deque()
+
+    async def run_once(self, bot) -> None:
+        for chat_id in self.cache.stale_counts(self.count_age, self.batch):
+            try:
+                self.cache.set_count(chat_id, await bot.get_chat_member_count(int(chat_id)))
+            except Forbidden:
+                # Бота нет в чате — число запросим заново, если его вернут
+                self.cache.invalidate_count(chat_id)
+            except Exception as e:
+                logging.error(f"Ошибка при сверке числа участников чата {chat_id}: {e}",
+                              extra={"throttle": "roster_sync"})
+
+        # Очередная порция участников; когда все проверены, начинаем новый круг
+        if not self._pending:
+            self._pending.extend(
+                (chat_id, member.id)
+                for chat_id in self.registry.chat_ids()
+                for member in self.registry.members(chat_id)
+            )
+        for _ in range(min(self.batch, len(self._pending))):
+            chat_id, user_id = self._pending.popleft()
+            member = self.registry.get(chat_id, user_id)
+            if member is None:
+                continue
+            try:
+                chat_member = await bot.get_chat_member(int(chat_id), user_id)
+            except RetryAfter:
+                # Сверка не срочная: продолжим в следующий раз
+                self._pending.appendleft((chat_id, user_id))
+                return
+            except Exception as e:
+                logging.error(f"Ошибка при сверке участника {user_id} чата {chat_id}: {e}",
+                              extra={"throttle": "roster_sync"})
+                continue
+
+            if not is_member(chat_member):
+                self.registry.remove(chat_id, user_id)
+                self.removed += 1
+                self.on_change(chat_id, user_id)
+            elif chat_member.user.first_name and chat_member.user.first_name != member.first_name:
+                member.first_name = chat_member.user.first_name
+                self.on_change(chat_id, user_id)
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from telegram.error import RetryAfter
+
+# Полосы приоритета: короткие ответы на команды, правки сообщений, массовые рассылки
+INTERACTIVE, EDITS, BULK = 0, 1, 2
+
+
+# Пауза из ответа 429 в секундах (retry_after бывает числом или timedelta)
+def retry_delay(error) -> float:
+    delay = error.retry_after
+    if hasattr(delay, "total_seconds"):
+        delay = delay.total_seconds()
+    return float(delay)
+
+
+class _Request:
+    __slots__ = ("bot", "method", "kwargs", "futures", "attempts", "key")
+
+    def __init__(self, bot, method, kwargs, key=None):
+        self.bot = bot
+        self.method = method
+        self.kwargs = kwargs
+        self.futures = []
+        self.attempts = 0
+        self.key = key
+
+
+class _Chat:
+    __slots__ = ("queues", "next_allowed", "blocked_until", "busy")
+
+    def __init__(self):
+        self.queues = (deque(), deque(), deque())
+        self.next_allowed = [0.0, 0.0, 0.0]
+        self.blocked_until = 0.0
+        self.busy = False
+
+    def pending(self) -> bool:
+        return any(self.queues)
+
+
+class OutboundScheduler:
+    """
+    Единая очередь исходящих сообщений бота.
+    Из всех чатов первым уходит запрос самой приоритетной полосы (INTERACTIVE, затем EDITS,
+    затем BULK), чаты внутри полосы обслуживаются по кругу. В одном чате одновременно идёт
+    один запрос, а между запросами одной полосы проходит не меньше intervals[полоса] секунд;
+    общий темп ограничен global_rate запросами в секунду. При ответе 429 чат ждёт retry_after
+    и запрос повторяется. Правка сообщения, которое уже ждёт правки, заменяет её текст:
+    уходит только последняя версия.
+    """
+
+    def __init__(self, intervals=(0.0, 1.0, 3.0), global_rate=30.0, max_retries=3):
+        self.intervals = intervals
+        self.global_rate = global_rate
+        self.max_retries = max_retries
+        self.sent = 0
+        self.coalesced = 0
+        self._chats = OrderedDict()
+        self._edits = {}
+        self._tokens = global_rate
+        self._tokens_updated = time.monotonic()
+        self._wake = asyncio.Event()
+        self._task = None
+        # Выполняющиеся запросы: ссылки держим сами, цикл событий хранит задачи только слабо
+        self._running = set()
+
+    # Запросов в очереди (без выполняющихся)
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for chat in self._chats.values() for queue in chat.queues)
+
+    async def send(self, bot, chat_id, text, lane=INTERACTIVE, wait=True, **kwargs):
+        request = _Request(bot, "send_message", {"chat_id": chat_id, "text": text, **kwargs})
+        return await self._submit(chat_id, lane, request, wait)
+
+    # Ответ на сообщение, как Message.reply_text: в группах — с цитатой исходного сообщения
+    async def reply(self, message, text, lane=INTERACTIVE, wait=True, **kwargs):
+        if "reply_parameters" not in kwargs and "reply_to_message_id" not in kwargs and message.chat.type != "private":
+            kwargs["reply_to_message_id"] = message.message_id
+        if message.is_topic_message and "message_thread_id" not in kwargs:
+            kwargs["message_thread_id"] = message.message_thread_id
+        return await self.send(message.get_bot(), message.chat_id, text, lane=lane, wait=wait, **kwargs)
+
+    async def edit(self, bot, chat_id, message_id, text, wait=True, **kwargs):
+        key = (chat_id, message_id)
+        request = self._edits.get(key)
+        if request is not None:
+            # Правка ещё не ушла — просто подменяем текст
+            request.kwargs.update(text=text, **kwargs)
+            self.coalesced += 1
+            return await self._wait(request, wait)
+        request = _Request(bot, "edit_message_text",
+                           {"chat_id": chat_id, "message_id": message_id, "text": text, **kwargs}, key=key)
+        self._edits[key] = request
+        return await self._submit(chat_id, EDITS, request, wait)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    # Дожидаемся отправки всего, что уже в очереди (не дольше timeout секунд)
+    async def stop(self, timeout=10.0) -> None:
+        deadline = time.monotonic() + timeout
+        while self.depth or self._running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self._running:
+                await asyncio.wait(self._running, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                # Очередь ждёт паузы чата или общего темпа — запросы заберёт _dispatch
+                await asyncio.sleep(min(0.05, remaining))
+        if self.depth or self._running:
+            logging.warning(f"Не отправлено сообщений при остановке: {self.depth + len(self._running)}")
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        running = list(self._running)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    async def _submit(self, chat_id, lane, request, wait):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat()
+        chat.queues[lane].append(request)
+        self._wake.set()
+        return await self._wait(request, wait)
+
+    async def _wait(self, request, wait):
+        if not wait:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        request.futures.append(future)
+        return await future
+
+    # Следующий запрос: (чат, полоса) или (None, секунды до ближайшего готового)
+    def _pick(self, now):
+        wait = None
+        for lane in (INTERACTIVE, EDITS, BULK):
+            for chat_id, chat in self._chats.items():
+                if chat.busy or not chat.queues[lane]:
+                    continue
+                ready_at = max(chat.blocked_until, chat.next_allowed[lane])
+                if ready_at <= now:
+                    self._chats.move_to_end(chat_id)
+                    return chat, lane, 0.0
+                wait = ready_at - now if wait is None else min(wait, ready_at - now)
+        return None, None, wait
+
+    async def _dispatch(self) -> None:
+        while True:
+            now = time.monotonic()
+            chat, lane, wait = self._pick(now)
+            if chat is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._tokens = min(self.global_rate, self._tokens + (now - self._tokens_updated) * self.global_rate)
+            self._tokens_updated = now
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.global_rate)
+                continue
+            self._tokens -= 1
+
+            request = chat.queues[lane].popleft()
+            if request.key is not None and self._edits.get(request.key) is request:
+                del self._edits[request.key]
+            chat.busy = True
+            task = asyncio.create_task(self._execute(chat, lane, request))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, chat, lane, request) -> None:
+        try:
+            result = await getattr(request.bot, request.method)(**request.kwargs)
+        except RetryAfter as e:
+            delay = retry_delay(e)
+            chat_id = request.kwargs["chat_id"]
+            logging.warning(f"Лимит отправки в чат {chat_id}, ждём {delay} с", extra={"throttle": "retry_after"})
+            chat.blocked_until = time.monotonic() + delay
+            request.attempts += 1
+            newer = self._edits.get(request.key) if request.key is not None else None
+            if newer is not None:
+                # Пока ждали, пришла более новая правка того же сообщения — эта уже не нужна
+                newer.futures.extend(request.futures)
+            elif request.attempts <= self.max_retries:
+                chat.queues[lane].appendleft(request)
+                if request.key is not None:
+                    self._edits[request.key] = request
+            else:
+                self._fail(request, e)
+        except asyncio.CancelledError:
+            # Остановка: ожидающие ответа не должны висеть вечно
+            for future in request.futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            self._fail(request, e)
+        else:
+            self.sent += 1
+            for future in request.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            chat.busy = False
+            chat.next_allowed[lane] = time.monotonic() + self.intervals[lane]
+            self._forget_idle()
+            self._wake.set()
+
+    def _fail(self, request, error) -> None:
+        if not request.futures:
+            logging.error(f"Ошибка при отправке ({request.method}) в чат {request.kwargs.get('chat_id')}: {error}")
+        for future in request.futures:
+            if not future.done():
+                future.set_exception(error)
+
+    # Удаляем чаты без очереди, которым больше не нужна пауза
+    def _forget_idle(self) -> None:
+        now = time.monotonic()
+        idle = [
+            chat_id for chat_id, chat in self._chats.items()
+            if not chat.busy and not chat.pending()
+            and chat.blocked_until <= now and max(chat.next_allowed) <= now
+        ]
+        for chat_id in idle:
+            del self._chats[chat_id]
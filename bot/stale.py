@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import time
+
+POLICIES = ("drop", "register")
+
+
+class StaleUpdateFilter:
+    """
+    Отсев накопившихся обновлений до обработчиков: сообщения, отправленные раньше started_at,
+    дальше не передаются. С политикой register их авторы всё же добавляются в участники чата —
+    одной пачкой через register({(chat_id, user_id): first_name}, service), а служебные сообщения
+    о входе и выходе (service, по порядку) применяются после авторов, чтобы вышедший остался
+    удалённым. Автор сообщения о собственном выходе в авторы не попадает.
+    Вместо строки лога на каждое сообщение пишется одна сводка, когда поток накопившихся затих.
+    """
+
+    def __init__(self, policy="register", register=None, started_at=None, summary_delay=1.0, max_window=30.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Неизвестная политика для накопившихся обновлений: {policy}")
+        self.policy = policy
+        self.started_at = started_at
+        self.summary_delay = summary_delay
+        self.max_window = max_window
+        self.total_dropped = 0
+        self._register = register
+        self._authors = {}
+        self._service = []
+        self._dropped = 0
+        self._first_dropped = 0.0
+        self._summary = None
+
+    def is_stale(self, update) -> bool:
+        message = update.message
+        if message is None or self.started_at is None or message.date >= self.started_at:
+            return False
+
+        self._dropped += 1
+        self.total_dropped += 1
+        if self.policy == "register":
+            left = message.left_chat_member
+            if message.new_chat_members or left is not None:
+                self._service.append(message)
+            author = message.from_user
+            if author is not None and not (left is not None and left.id == author.id):
+                self._authors[(str(message.chat_id), author.id)] = author.first_name
+
+        # Сводка и регистрация — после паузы в summary_delay секунд без накопившихся обновлений,
+        # но не реже раза в max_window секунд, если они идут непрерывно
+        now = time.monotonic()
+        if self._summary is None:
+            self._first_dropped = now
+        elif now - self._first_dropped >= self.max_window:
+            self.flush()
+            return True
+        else:
+            self._summary.cancel()
+        self._summary = asyncio.get_running_loop().call_later(self.summary_delay, self.flush)
+        return True
+
+    def flush(self) -> None:
+        if self._summary is not None:
+            self._summary.cancel()
+            self._summary = None
+        if not self._dropped:
+            return
+
+        authors, self._authors = self._authors, {}
+        service, self._service = self._service, []
+        summary = f"Пропущено накопившихся обновлений: {self._dropped} за {time.monotonic() - self._first_dropped:.1f} с"
+        if self.policy == "register" and self._register is not None:
+            try:
+                summary += f", добавлено участников: {self._register(authors, service)}"
+            except Exception as e:
+                logging.error(f"Ошибка при добавлении авторов накопившихся сообщений: {e}")
+        self._dropped = 0
+        logging.info(summary)
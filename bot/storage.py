@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+
+from persistence import atomic_write_json
+
+
+class Storage:
+    """
+    Интерфейс хранилища участников.
+    Данные отдаются в формате active_users.json: {chat_id: [{"id", "first_name", "nickname", "isAdmin"}]}.
+    snapshot() вызывается в цикле событий и готовит данные для write(), которая выполняется в потоке.
+    load_chat() тоже вызывается из потока (MemberRegistry.preload), поэтому чтение и запись
+    в одном хранилище разделяет блокировка.
+    Хранилище с shared = True можно открыть из нескольких процессов: set_names() и
+    changes_since() есть только у него.
+    """
+
+    shared = False
+
+    def load_chat(self, chat_id) -> list:
+        raise NotImplementedError
+
+    # Записывает first_name участников чата {user_id: имя}, не трогая остальные поля
+    def set_names(self, chat_id, names) -> None:
+        raise NotImplementedError
+
+    # (номер последнего изменения, чаты, изменённые другими процессами после seq);
+    # seq=None — только номер, None вместо списка — журнал уже обрезан, изменённым считается всё
+    def changes_since(self, seq):
+        raise NotImplementedError
+
+    def snapshot(self, registry, keys):
+        raise NotImplementedError
+
+    def write(self, payload) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class JsonStorage(Storage):
+    """
+    Один JSON-файл: любое изменение переписывает файл целиком.
+    Файл читается при первом обращении. load_chat() отдаёт копию и ничего не удаляет:
+    пока реестр загружает чат в потоке, запись не потеряет этот чат. При записи чаты,
+    загруженные в реестр, берутся из реестра, а остальные пишутся обратно как есть.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._raw = None
+        self._lock = threading.Lock()
+
+    def _data(self) -> dict:
+        if self._raw is None:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as file:
+                    self._raw = json.load(file)
+            else:
+                self._raw = {}
+        return self._raw
+
+    def load_chat(self, chat_id) -> list:
+        with self._lock:
+            return list(self._data().get(chat_id, []))
+
+    # Загруженные в реестр чаты (и опустевшие тоже) берутся из реестра, остальные — из файла
+    def snapshot(self, registry, keys):
+        with self._lock:
+            data = dict(self._data())
+        for chat_id in registry.loaded_ids():
+            data.pop(chat_id, None)
+        data.update(registry.to_json())
+        return data
+
+    def write(self, payload) -> None:
+        atomic_write_json(self.path, payload)
+
+
+class SqliteStorage(Storage):
+    """
+    SQLite в режиме WAL: одна строка на участника, изменения пишутся построчно.
+    Порядок участников в чате хранится в колонке position (индекс по chat_id, position).
+    Файл общий для бота и обработчиков (worker.py): каждая запись отмечает изменённые чаты
+    в журнале changes, по которому другие процессы узнают, какие чаты перечитать.
+    В журнале хранятся последние CHANGES_KEEP записей.
+    """
+
+    shared = True
+    CHANGES_KEEP = 10000
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS members (
+            chat_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            first_name TEXT,
+            nickname TEXT NOT NULL DEFAULT '',
+            is_admin INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS members_chat_position ON members (chat_id, position);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            writer TEXT NOT NULL
+        );
+    """
+
+    UPSERT = """
+        INSERT INTO members (chat_id, user_id, position, first_name, nickname, is_admin)
+        VALUES (?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM members WHERE chat_id = ?), ?, ?, ?)
+        ON CONFLICT (chat_id, user_id) DO UPDATE SET
+            first_name = excluded.first_name,
+            nickname = excluded.nickname,
+            is_admin = excluded.is_admin
+    """
+
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self.writer = f"{socket.gethostname()}:{os.getpid()}"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Одно соединение на чтение (load_chat) и запись (write) из потоков пула — под общей блокировкой
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        if json_path:
+            self.import_json(json_path)
+
+    # Однократный импорт существующего active_users.json
+    def import_json(self, json_path) -> int:
+        if self._get_meta("json_imported") or not os.path.exists(json_path):
+            return 0
+        with open(json_path, 'r') as file:
+            data = json.load(file)
+        rows = [
+            (str(chat_id), item["id"], position, item.get("first_name"), item.get("nickname", ""),
+             item.get("isAdmin", 0))
+            for chat_id, members in data.items()
+            for position, item in enumerate(members, start=1)
+        ]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO members (chat_id, user_id, position, first_name, nickname, is_admin) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._set_meta("json_imported", json_path)
+        logging.info(f"Импортировано {len(rows)} участников из {json_path} в {self.path}")
+        return len(rows)
+
+    def load_chat(self, chat_id) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, first_name, nickname, is_admin FROM members WHERE chat_id = ? ORDER BY position",
+                (chat_id,),
+            ).fetchall()
+        return [
+            {"id": user_id, "first_name": first_name, "nickname": nickname, "isAdmin": is_admin}
+            for user_id, first_name, nickname, is_admin in rows
+        ]
+
+    # Снимок только изменённых участников: ключи — пары (chat_id, user_id)
+    def snapshot(self, registry, keys):
+        upserts = []
+        deletes = []
+        for chat_id, user_id in keys:
+            member = registry.get(chat_id, user_id)
+            if member is None:
+                deletes.append((chat_id, user_id))
+            else:
+                upserts.append((chat_id, user_id, chat_id, member.first_name, member.nickname, member.is_admin))
+        return upserts, deletes
+
+    def write(self, payload) -> None:
+        upserts, deletes = payload
+        with self._lock, self._conn:
+            if upserts:
+                self._conn.executemany(self.UPSERT, upserts)
+            if deletes:
+                self._conn.executemany("DELETE FROM members WHERE chat_id = ? AND user_id = ?", deletes)
+            self._log_changes({row[0] for row in upserts} | {row[0] for row in deletes})
+
+    def set_names(self, chat_id, names) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE members SET first_name = ? WHERE chat_id = ? AND user_id = ?",
+                [(name, chat_id, user_id) for user_id, name in names.items()],
+            )
+            self._log_changes({chat_id})
+
+    def changes_since(self, seq):
+        with self._lock:
+            first, last = self._conn.execute("SELECT MIN(seq), MAX(seq) FROM changes").fetchone()
+            last = last or 0
+            if seq is None or seq >= last:
+                return last, []
+            if first > seq + 1:
+                return last, None
+            rows = self._conn.execute(
+                "SELECT DISTINCT chat_id FROM changes WHERE seq > ? AND writer != ?", (seq, self.writer)
+            ).fetchall()
+        return last, [chat_id for (chat_id,) in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # Вызывается внутри транзакции записи
+    def _log_changes(self, chat_ids) -> None:
+        if not chat_ids:
+            return
+        self._conn.executemany(
+            "INSERT INTO changes (chat_id, writer) VALUES (?, ?)", [(chat_id, self.writer) for chat_id in chat_ids]
+        )
+        self._conn.execute(
+            "DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?", (self.CHANGES_KEEP,)
+        )
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+# Выбор хранилища по имени из переменной окружения STORAGE_BACKEND
+def open_storage(backend, json_path, sqlite_path) -> Storage:
+    if backend == "json":
+        return JsonStorage(json_path)
+    if backend == "sqlite":
+        return SqliteStorage(sqlite_path, json_path=json_path)
+    raise ValueError(f"Неизвестное хранилище: {backend}")
@@ -0,0 +1,72 @@
+import json
+
+import speech_recognition as sr
+
+from audio import SAMPLE_WIDTH
+
+
+class RecognizerEngine:
+    """
+    Движок распознавания речи.
+    transcribe() — блокирующий вызов, получает сырой PCM (моно, 16 бит) с частотой sample_rate
+    и выполняется в пуле очереди расшифровки.
+    """
+
+    name = ""
+    sample_rate = 16000
+
+    def transcribe(self, pcm: bytes, language: str) -> str:
+        raise NotImplementedError
+
+
+class GoogleEngine(RecognizerEngine):
+    """Google Web Speech API через speech_recognition (сетевой вызов на каждый фрагмент)."""
+
+    name = "google"
+
+    def transcribe(self, pcm: bytes, language: str) -> str:
+        recognizer = sr.Recognizer()
+        audio_data = sr.AudioData(pcm, self.sample_rate, SAMPLE_WIDTH)
+        try:
+            return recognizer.recognize_google(audio_data, language=language)
+        except sr.UnknownValueError:
+            # Во фрагменте нет разборчивой речи
+            return ""
+
+
+class VoskEngine(RecognizerEngine):
+    """Локальное распознавание на CPU через Vosk. Язык определяется моделью из model_path."""
+
+    name = "vosk"
+
+    def __init__(self, model_path=None):
+        try:
+            import vosk
+        except ImportError:
+            raise RuntimeError("Для STT_ENGINE=vosk установите пакет vosk")
+        if not model_path:
+            raise RuntimeError("Для STT_ENGINE=vosk задайте VOSK_MODEL_PATH")
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self._model = vosk.Model(model_path)
+
+    def transcribe(self, pcm: bytes, language: str) -> str:
+        recognizer = self._vosk.KaldiRecognizer(self._model, self.sample_rate)
+        recognizer.AcceptWaveform(pcm)
+        return json.loads(recognizer.FinalResult()).get("text", "")
+
+
+ENGINES = {
+    GoogleEngine.name: GoogleEngine,
+    VoskEngine.name: VoskEngine,
+}
+
+
+# Создание движка по имени из переменной окружения STT_ENGINE
+def create_engine(name, **options) -> RecognizerEngine:
+    engine_class = ENGINES.get(name)
+    if engine_class is None:
+        raise ValueError(f"Неизвестный движок распознавания: {name}")
+    if engine_class is VoskEngine:
+        return VoskEngine(options.get("vosk_model_path"))
+    return engine_class()
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    """Очередь расшифровки переполнена."""
+
+
+class TranscriptionQueue:
+    """
+    Ограниченная очередь задач расшифровки.
+    Задача — корутина без аргументов; блокирующую работу (декодирование, распознавание)
+    она выполняет через run_blocking() в пуле потоков, не занимая цикл событий.
+    Одновременно выполняется не больше workers задач, ждать может не больше max_depth.
+    """
+
+    def __init__(self, workers=2, max_depth=20):
+        self.workers = workers
+        self.max_depth = max_depth
+        self._queue = asyncio.Queue(maxsize=max_depth)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transcribe")
+        self._tasks = []
+        self._busy = 0
+
+    # Число задач, ожидающих в очереди
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def busy(self) -> int:
+        return self._busy
+
+    # Ставит задачу в очередь и возвращает её позицию (0 — начнётся сразу)
+    def submit(self, job) -> int:
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFull()
+        idle = self.workers - self._busy
+        return max(self._queue.qsize() - idle, 0)
+
+    async def run_blocking(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    # Ждём, пока очередь опустеет (не дольше timeout секунд)
+    async def drain(self, timeout) -> None:
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Очередь расшифровки не опустела за {timeout} с, осталось {self._queue.qsize()}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            self._busy += 1
+            try:
+                await job()
+            except Exception as e:
+                logging.error(f"Ошибка в задаче расшифровки: {e}")
+            finally:
+                self._busy -= 1
+                self._queue.task_done()
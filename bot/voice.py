@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import threading
+
+
+class VoiceTranscriber:
+    """
+    Расшифровка голосового по file_id: скачивание, декодирование и распознавание по фрагментам
+    с промежуточными правками статусного сообщения бота. Не зависит от обработчиков Telegram,
+    поэтому одинаково работает в основном процессе и в отдельных обработчиках (worker.py).
+    Аудио и движок распознавания импортируются при первой расшифровке.
+    max_seconds — предел длины речи (после обрезки тишины): длиннее — отказ, None — режем на фрагменты.
+    Правки статусного сообщения идут через outbox (sender.OutboundScheduler).
+    """
+
+    def __init__(self, queue, cache, engine_name, language, chunk_seconds=25.0, memory_limit=20 * 1024 * 1024,
+                 vosk_model_path=None, max_seconds=None, silence_db=-45.0, outbox=None):
+        self.queue = queue
+        self.cache = cache
+        self.engine_name = engine_name
+        self.language = language
+        self.chunk_seconds = chunk_seconds
+        self.memory_limit = memory_limit
+        self.vosk_model_path = vosk_model_path
+        self.max_seconds = max_seconds
+        self.silence_db = silence_db
+        self.outbox = outbox
+        self._engine = None
+        self._engine_lock = threading.Lock()
+
+    # Движок создаётся при первом голосовом (вызывается из пула расшифровки)
+    def engine(self):
+        if self._engine is None:
+            with self._engine_lock:
+                if self._engine is None:
+                    from stt import create_engine
+                    self._engine = create_engine(self.engine_name, vosk_model_path=self.vosk_model_path)
+                    logging.info(f"Загружен движок распознавания речи: {self.engine_name}")
+        return self._engine
+
+    # Задание на расшифровку: файл, ключ кэша и статусное сообщение, в котором показывается результат
+    @staticmethod
+    def job(media, cache_key, status_message) -> dict:
+        return {
+            "file_id": media.file_id,
+            "cache_key": cache_key,
+            "chat_id": status_message.chat_id,
+            "message_id": status_message.message_id,
+        }
+
+    # Скачивает файл в память и распознаёт его в пуле, не блокируя цикл событий
+    async def run(self, bot, job) -> None:
+        from audio import AudioTooLong, download_audio
+
+        async def edit(text, wait=True):
+            await self.outbox.edit(bot, job["chat_id"], job["message_id"], text, wait=wait)
+
+        buffer = None
+        try:
+            # Голосовое сообщение или видеосообщение (кружочек)
+            file = await bot.get_file(job["file_id"])
+
+            # Скачиваем файл в память (очень длинные кружочки — во временный файл)
+            buffer = await download_audio(file, self.memory_limit)
+
+            # Декодируем в формат движка и режем длинное аудио на фрагменты по паузам
+            chunks = await self.queue.run_blocking(self.decode_chunks, buffer)
+            engine = self.engine()
+
+            # Фрагменты распознаются параллельно, а текст собирается по порядку
+            # и показывается частями по мере готовности
+            tasks = [
+                asyncio.ensure_future(self.queue.run_blocking(engine.transcribe, chunk, self.language))
+                for chunk in chunks
+            ]
+            parts = []
+            try:
+                for index, task in enumerate(tasks, start=1):
+                    part = await task
+                    if part:
+                        parts.append(part)
+                    if index < len(tasks) and parts:
+                        await edit(f"Распознанный текст ({index}/{len(tasks)}): {' '.join(parts)}…", wait=False)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+            if parts:
+                text = " ".join(parts)
+                await self.cache.put(job["cache_key"], text)
+                await edit(f"Распознанный текст: {text}")
+            else:
+                await edit("Не удалось распознать речь.")
+
+        except AudioTooLong as e:
+            await edit(f"Слишком длинное сообщение ({e.seconds:.0f} с), расшифровываю не больше {e.limit:.0f} с.")
+
+        except Exception as e:
+            logging.error(f"Ошибка при расшифровке голосового сообщения: {e}")
+            await edit("Произошла ошибка при расшифровке голосового сообщения.")
+
+        finally:
+            if buffer is not None:
+                buffer.close()
+
+    # Блокирующая часть расшифровки (выполняется в пуле): декодирование, подготовка
+    # (моно, частота движка, обрезка тишины, проверка длины) и нарезка на фрагменты
+    def decode_chunks(self, buffer) -> list:
+        from audio import decode_audio, preprocess, split_on_silence
+
+        engine = self.engine()
+        samples, sample_rate = decode_audio(buffer)
+        pcm = preprocess(samples, sample_rate, engine.sample_rate, silence_db=self.silence_db,
+                         max_seconds=self.max_seconds)
+        return split_on_silence(pcm, engine.sample_rate, chunk_seconds=self.chunk_seconds,
+                                max_seconds=self.chunk_seconds * 1.6)
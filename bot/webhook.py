@@ -0,0 +1,62 @@
+import hmac
+import logging
+
+from aiohttp import web
+from telegram import Update
+
+
+class WebhookServer:
+    """
+    HTTP-приёмник обновлений Telegram на aiohttp.
+    Проверяет заголовок X-Telegram-Bot-Api-Secret-Token (секрет обязателен) и кладёт обновления
+    в очередь приложения.
+    После stop() новые запросы получают 503, а уже принятые обновления дорабатывает приложение.
+    """
+
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+    def __init__(self, application, listen="0.0.0.0", port=8443, path="/telegram", secret_token=None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        if not secret_token:
+            raise ValueError("Для приёма обновлений через вебхук нужен secret_token")
+        self.secret_token = secret_token
+        self._runner = None
+        self._closing = False
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        return app
+
+    async def start(self) -> None:
+        self._closing = False
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        logging.info(f"Вебхук слушает {self.listen}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        self._closing = True
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        header = request.headers.get(self.SECRET_HEADER, "")
+        if not hmac.compare_digest(header, self.secret_token):
+            return web.Response(status=403)
+        if self._closing:
+            # Telegram повторит доставку позже
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logging.error(f"Некорректное обновление в вебхуке: {e}")
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response()
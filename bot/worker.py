@@ -0,0 +1,216 @@
+"""
+Обработчик тяжёлых задач в отдельном процессе.
+
+Основной процесс (main.py с TRANSCRIBE_BROKER) принимает обновления и ставит расшифровку
+голосовых в очередь-брокер; процессы worker.py забирают задачи, а правки статусных сообщений
+возвращают через брокер основному процессу — он отправляет их со своим темпом по чатам.
+С общим хранилищем участников (STORAGE_BACKEND=sqlite) обработчики также получают имена
+участников для /check_all и пишут их в хранилище, а бот перечитывает изменённые чаты.
+Процессов можно запустить сколько угодно — задача достаётся ровно одному из них.
+
+Пример:
+    TRANSCRIBE_BROKER=data/jobs.db python main.py
+    TRANSCRIBE_BROKER=data/jobs.db python worker.py
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+
+from dotenv import load_dotenv
+from telegram import Bot
+
+from broker import JobBroker, RelayedOutbox
+from cache import TranscriptCache
+from logsetup import setup_logging
+from metrics import InstrumentedRequest
+from resolver import MemberResolver
+from storage import SqliteStorage
+from transcription import TranscriptionQueue
+from voice import VoiceTranscriber
+
+load_dotenv()
+
+setup_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    fmt=os.getenv('LOG_FORMAT', 'text'),
+    levels=os.getenv('LOG_LEVELS', ''),
+    throttle_burst=int(os.getenv('LOG_THROTTLE_BURST', '10')),
+    throttle_per=float(os.getenv('LOG_THROTTLE_PERIOD', '60')),
+)
+
+TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+TRANSCRIBE_BROKER = os.getenv('TRANSCRIBE_BROKER')
+if not TELEGRAM_TOKEN or not TRANSCRIBE_BROKER:
+    print("Ошибка: не заданы TELEGRAM_TOKEN или TRANSCRIBE_BROKER в .env файле.")
+    exit(1)
+
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+TELEGRAM_FILE_URL = os.getenv('TELEGRAM_FILE_URL')
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '30'))
+# Как часто спрашивать брокер о новых задачах, когда очередь пуста
+POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', '0.5'))
+WORKER_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+
+job_broker = JobBroker(
+    TRANSCRIBE_BROKER,
+    lease=float(os.getenv('WORKER_LEASE', '300')),
+    max_attempts=int(os.getenv('WORKER_MAX_ATTEMPTS', '3')),
+)
+
+# Участники общие с ботом только в SQLite; с json обработчики берут лишь расшифровку
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+storage = SqliteStorage(os.getenv('SQLITE_FILE', 'data/bot.db')) if STORAGE_BACKEND == 'sqlite' else None
+member_resolver = MemberResolver(
+    concurrency=int(os.getenv('RESOLVE_CONCURRENCY', '8')),
+    ttl=float(os.getenv('RESOLVE_CACHE_TTL', '3600')),
+)
+
+# Сколько задач процесс выполняет одновременно (потоки декодирования и распознавания)
+TRANSCRIBE_WORKERS = int(os.getenv('TRANSCRIBE_WORKERS', '2'))
+transcription_queue = TranscriptionQueue(workers=TRANSCRIBE_WORKERS, max_depth=TRANSCRIBE_WORKERS)
+
+# Дисковый кэш (TRANSCRIPT_CACHE_FILE) общий с основным процессом: он отвечает из кэша сам
+transcript_cache = TranscriptCache(
+    max_items=int(os.getenv('TRANSCRIPT_CACHE_SIZE', '1000')),
+    disk_path=os.getenv('TRANSCRIPT_CACHE_FILE') or None,
+    ttl=float(os.getenv('TRANSCRIPT_CACHE_TTL', str(30 * 24 * 3600))),
+    max_disk_bytes=int(os.getenv('TRANSCRIPT_CACHE_MAX_BYTES', str(50 * 1024 * 1024))),
+)
+
+# Правки статусных сообщений отправляет основной процесс (с темпом и слиянием правок)
+outbox = RelayedOutbox(job_broker)
+
+voice_transcriber = VoiceTranscriber(
+    transcription_queue, transcript_cache, os.getenv('STT_ENGINE', 'google'), os.getenv('STT_LANGUAGE', 'ru-RU'),
+    chunk_seconds=float(os.getenv('STT_CHUNK_SECONDS', '25')),
+    memory_limit=int(os.getenv('AUDIO_MEMORY_LIMIT', str(20 * 1024 * 1024))),
+    vosk_model_path=os.getenv('VOSK_MODEL_PATH'),
+    max_seconds=float(os.getenv('STT_MAX_SECONDS', '600')) or None,
+    silence_db=float(os.getenv('STT_SILENCE_DB', '-45')),
+    outbox=outbox,
+)
+
+
+# Имена участников без имени: пишутся в общее хранилище, бот перечитает чат сам
+async def resolve_names(bot, payload) -> None:
+    chat_id = payload["chat_id"]
+    wanted = set(payload["user_ids"])
+    items = await asyncio.to_thread(storage.load_chat, chat_id)
+    missing = [
+        item["id"] for item in items
+        if item["id"] in wanted and not (item.get("nickname") or item.get("first_name"))
+    ]
+    names = await member_resolver.resolve_many(bot, int(chat_id), missing)
+    if names:
+        await asyncio.to_thread(storage.set_names, chat_id, names)
+
+
+# Обработчики задач по виду
+JOB_HANDLERS = {"transcribe": voice_transcriber.run}
+if storage is not None:
+    JOB_HANDLERS["resolve_names"] = resolve_names
+
+
+# Задачу, которая уже роняла процессы, не повторяем — о расшифровке сообщаем в чат
+async def run_job(bot, job) -> None:
+    payload = job["payload"]
+    try:
+        if job["attempts"] > job_broker.max_attempts:
+            logging.error(f"Задача {job['id']} не выполнена за {job_broker.max_attempts} попыток")
+            if job["kind"] == "transcribe":
+                await outbox.edit(bot, payload["chat_id"], payload["message_id"],
+                                  "Произошла ошибка при расшифровке голосового сообщения.")
+        else:
+            await JOB_HANDLERS[job["kind"]](bot, payload)
+    except Exception as e:
+        logging.error(f"Ошибка при выполнении задачи {job['id']}: {e}")
+
+
+# Продлевает аренду, пока задача выполняется. Если задачу уже забрал другой обработчик
+# (процесс долго стоял и аренда истекла), прерываем её, чтобы не ответить в чат дважды
+async def keep_lease(job, work) -> bool:
+    while True:
+        await asyncio.sleep(job_broker.lease / 3)
+        if not await asyncio.to_thread(job_broker.heartbeat, job["id"], WORKER_ID, job["attempts"]):
+            logging.warning(f"Задача {job['id']} перешла другому обработчику, прерываем")
+            work.cancel()
+            return False
+
+
+# Выполняет задачу и удаляет её из брокера (если она всё ещё наша). Отменённая при
+# остановке задача остаётся в claimed — её вернёт в очередь run_worker
+async def handle_job(bot, job, claimed) -> None:
+    work = asyncio.ensure_future(run_job(bot, job))
+    heartbeat = asyncio.create_task(keep_lease(job, work))
+    try:
+        await work
+    except asyncio.CancelledError:
+        if not (heartbeat.done() and heartbeat.result() is False):
+            raise
+        claimed.pop(job["id"], None)
+        return
+    finally:
+        heartbeat.cancel()
+    await asyncio.to_thread(job_broker.complete, job["id"], WORKER_ID, job["attempts"])
+    claimed.pop(job["id"], None)
+
+
+# Берём задачу, только когда есть свободный поток: остальные достанутся другим процессам
+async def run_worker(stop_event) -> None:
+    bot = Bot(
+        TELEGRAM_TOKEN,
+        base_url=TELEGRAM_API_URL or "https://api.telegram.org/bot",
+        base_file_url=TELEGRAM_FILE_URL or "https://api.telegram.org/file/bot",
+        request=InstrumentedRequest(connection_pool_size=16),
+    )
+    async with bot:
+        await transcription_queue.start()
+        logging.info(f"Обработчик {WORKER_ID} запущен")
+        # Взятые, но ещё не завершённые задачи: {id: задача}
+        claimed = {}
+        try:
+            while not stop_event.is_set():
+                job = None
+                if transcription_queue.depth + transcription_queue.busy < transcription_queue.workers:
+                    job = await asyncio.to_thread(job_broker.claim, WORKER_ID, list(JOB_HANDLERS))
+                if job is not None:
+                    claimed[job["id"]] = job
+                    transcription_queue.submit(lambda job=job: handle_job(bot, job, claimed))
+                    continue
+                try:
+                    await asyncio.wait_for(stop_event.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            logging.info("Получен сигнал остановки, дорабатываем взятые задачи")
+        finally:
+            # Задачи, не завершённые за SHUTDOWN_TIMEOUT, отменяются и возвращаются в очередь
+            await transcription_queue.drain(SHUTDOWN_TIMEOUT)
+            await transcription_queue.stop()
+            # Попытка не засчитывается: задачу сразу подхватит другой обработчик
+            for job in claimed.values():
+                if await asyncio.to_thread(job_broker.release, job["id"], WORKER_ID, job["attempts"]):
+                    logging.info(f"Задача {job['id']} возвращена в очередь")
+    transcript_cache.close()
+    if storage is not None:
+        storage.close()
+    job_broker.close()
+
+
+async def main() -> None:
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        await run_worker(stop_event)
+    except Exception as e:
+        logging.error(f"Ошибка в основном цикле обработчика: {e}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+from audio import AudioBuffer, decode_audio, needs_seek
+
+ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="нет ffmpeg")
+
+
+def box(name, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), name) + payload
+
+
+def test_needs_seek_only_for_mp4_with_moov_after_mdat():
+    assert needs_seek(box(b"ftyp", b"isom") + box(b"mdat", b"x" * 16) + box(b"moov"))
+    assert not needs_seek(box(b"ftyp", b"isom") + box(b"moov") + box(b"mdat", b"x" * 16))
+    assert not needs_seek(b"OggS" + b"\0" * 60)
+
+
+# MP4 по умолчанию пишется с индексом (moov) после данных — как кружочки из некоторых клиентов
+def moov_at_end_sample(tmp_path):
+    path = tmp_path / "sample.mp4"
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "sine=frequency=440:duration=30",
+         "-c:a", "aac", str(path)],
+        check=True,
+    )
+    data = path.read_bytes()
+    assert needs_seek(data)
+    return data
+
+
+@ffmpeg
+# Буфер в памяти переносится на диск перед декодированием; буфер уже на диске отдаётся как есть
+@pytest.mark.parametrize("max_size", [1, 1 << 30])
+def test_decode_mp4_with_moov_at_end(tmp_path, max_size):
+    data = moov_at_end_sample(tmp_path)
+    buffer = AudioBuffer(max_size=max_size)
+    buffer.write(data)
+    samples, rate = decode_audio(buffer)
+    assert buffer.on_disk
+    assert len(samples) == pytest.approx(30 * rate, rel=0.05)
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from broker import OUTBOUND, JobBroker
+
+
+@pytest.fixture
+def broker(tmp_path):
+    broker = JobBroker(str(tmp_path / "jobs.db"), lease=0.2, max_attempts=3)
+    yield broker
+    broker.close()
+
+
+def test_claim_returns_oldest_job_of_requested_kind(broker):
+    assert broker.enqueue("transcribe", {"n": 1}) == 0
+    assert broker.enqueue(OUTBOUND, {"n": 2}) == 0
+    assert broker.enqueue("transcribe", {"n": 3}) == 1
+    job = broker.claim("w1", ["transcribe"])
+    assert job["kind"] == "transcribe" and job["payload"] == {"n": 1} and job["attempts"] == 1
+    assert broker.depth(["transcribe"]) == 1
+    assert broker.depth() == 2
+    assert broker.running() == 1
+
+
+def test_claim_on_empty_queue(broker):
+    assert broker.claim("w1") is None
+
+
+def test_running_job_is_not_claimed_twice(broker):
+    broker.enqueue("transcribe", {})
+    assert broker.claim("w1") is not None
+    assert broker.claim("w2") is None
+
+
+def test_expired_lease_is_reclaimed_and_old_owner_loses_it(broker):
+    broker.enqueue("transcribe", {})
+    first = broker.claim("w1")
+    time.sleep(0.3)
+    second = broker.claim("w2")
+    assert second["id"] == first["id"] and second["attempts"] == 2
+    assert not broker.heartbeat(first["id"], "w1", first["attempts"])
+    assert not broker.complete(first["id"], "w1", first["attempts"])
+    assert not broker.release(first["id"], "w1", first["attempts"])
+    assert broker.complete(second["id"], "w2", second["attempts"])
+    assert broker.depth() == 0 and broker.running() == 0
+
+
+def test_heartbeat_keeps_lease(broker):
+    broker.enqueue("transcribe", {})
+    job = broker.claim("w1")
+    for _ in range(3):
+        time.sleep(0.1)
+        assert broker.heartbeat(job["id"], "w1", job["attempts"])
+    assert broker.claim("w2") is None
+
+
+def test_release_requeues_without_spending_attempt(broker):
+    broker.enqueue("transcribe", {})
+    job = broker.claim("w1")
+    assert broker.release(job["id"], "w1", job["attempts"])
+    assert broker.depth() == 1
+    again = broker.claim("w2")
+    assert again["attempts"] == 1
+
+
+def test_complete_without_owner_deletes_job(broker):
+    broker.enqueue(OUTBOUND, {})
+    job = broker.claim("relay", [OUTBOUND])
+    assert broker.complete(job["id"])
+    assert broker.claim("relay", [OUTBOUND]) is None
@@ -0,0 +1,83 @@
+import asyncio
+
+from expiring import ExpiringStore, TimerWheel
+
+
+def advance(wheel, ticks) -> list:
+    expired = []
+    for _ in range(ticks):
+        expired.extend(wheel.advance())
+    return expired
+
+
+def test_timer_fires_after_its_ticks():
+    wheel = TimerWheel(tick=1.0, size=8)
+    wheel.schedule("a", 3)
+    assert advance(wheel, 2) == []
+    assert wheel.advance() == ["a"]
+    assert len(wheel) == 0
+
+
+def test_timer_longer_than_one_revolution():
+    wheel = TimerWheel(tick=1.0, size=4)
+    wheel.schedule("a", 10)
+    assert advance(wheel, 9) == []
+    assert wheel.advance() == ["a"]
+
+
+def test_short_delay_rounds_up_to_one_tick():
+    wheel = TimerWheel(tick=1.0, size=4)
+    wheel.schedule("a", 0.1)
+    assert wheel.advance() == ["a"]
+
+
+def test_cancel_and_reschedule():
+    wheel = TimerWheel(tick=1.0, size=8)
+    wheel.schedule("a", 2)
+    wheel.schedule("b", 2)
+    wheel.cancel("a")
+    wheel.cancel("missing")
+    wheel.schedule("b", 4)
+    assert advance(wheel, 3) == []
+    assert wheel.advance() == ["b"]
+    assert len(wheel) == 0
+
+
+def test_store_expires_items_in_one_batch():
+    batches = []
+
+    async def on_expire(expired):
+        batches.append(sorted(expired))
+
+    async def run():
+        store = ExpiringStore(ttl=0.05, tick=0.02)
+        await store.start(on_expire)
+        store.put("a", 1)
+        store.put("b", 2)
+        store.put("c", 3, ttl=10)
+        await asyncio.sleep(0.2)
+        left = store.get("c"), len(store), store.expired
+        await store.stop()
+        return left
+
+    assert asyncio.run(run()) == (3, 1, 2)
+    assert batches == [[("a", 1), ("b", 2)]]
+
+
+def test_store_pop_cancels_expiry():
+    batches = []
+
+    async def on_expire(expired):
+        batches.append(expired)
+
+    async def run():
+        store = ExpiringStore(ttl=0.05, tick=0.02)
+        await store.start(on_expire)
+        store.put("a", 1)
+        popped = store.pop("a")
+        await asyncio.sleep(0.15)
+        await store.stop()
+        return popped, store.pop("a")
+
+    assert asyncio.run(run()) == (1, None)
+    assert batches == []
@@ -0,0 +1,90 @@
+import json
+
+from keywords import KeywordEngine, KeywordRule, normalize
+
+
+def ids(rules):
+    return sorted(rule.id for rule in rules)
+
+
+def test_overlapping_keywords_both_match():
+    engine = KeywordEngine([KeywordRule("cat", ["кот"], "мяу"), KeywordRule("father", ["отец"], "папа")])
+    assert ids(engine.match("1", "котец")) == ["cat", "father"]
+
+
+def test_keyword_that_is_prefix_of_longer_one():
+    engine = KeywordEngine([KeywordRule("cat", ["кот"], "мяу"), KeywordRule("cutlet", ["котлета"], "ням")])
+    assert ids(engine.match("1", "вкусная котлета")) == ["cat", "cutlet"]
+    assert ids(engine.match("1", "котик")) == ["cat"]
+
+
+def test_whole_word():
+    engine = KeywordEngine([KeywordRule("cat", ["кот"], "мяу", whole_word=True)])
+    assert ids(engine.match("1", "котлета")) == []
+    assert ids(engine.match("1", "скотина")) == []
+    assert ids(engine.match("1", "Кот!")) == ["cat"]
+    assert ids(engine.match("1", "это кот")) == ["cat"]
+
+
+def test_whole_word_checks_prefix_match_by_its_own_length():
+    engine = KeywordEngine([
+        KeywordRule("cat", ["кот"], "мяу", whole_word=True),
+        KeywordRule("cutlet", ["котлета"], "ням"),
+    ])
+    assert ids(engine.match("1", "котлета")) == ["cutlet"]
+
+
+def test_latin_look_alike_letters_and_yo():
+    engine = KeywordEngine([KeywordRule("minecraft", ["майнкрафт", "Minecraft"], "блоки"),
+                            KeywordRule("tree", ["ёлка"], "ель")])
+    assert ids(engine.match("1", "мaйнкрaфт")) == ["minecraft"]  # латинские «a»
+    assert ids(engine.match("1", "MINECRAFT")) == ["minecraft"]
+    assert ids(engine.match("1", "елка")) == ["tree"]
+    assert normalize("Cоxр") == "сохр"
+
+
+def test_rule_matches_once_per_message():
+    engine = KeywordEngine([KeywordRule("cat", ["кот", "кошка"], "мяу")])
+    assert [rule.id for rule in engine.match("1", "кот и кошка, ещё кот")] == ["cat"]
+
+
+def test_cooldown_is_per_chat():
+    engine = KeywordEngine([KeywordRule("cat", ["кот"], "мяу", cooldown=10)])
+    assert ids(engine.match("1", "кот", now=100.0)) == ["cat"]
+    assert ids(engine.match("1", "кот", now=105.0)) == []
+    assert ids(engine.match("2", "кот", now=105.0)) == ["cat"]
+    assert ids(engine.match("1", "кот", now=110.0)) == ["cat"]
+
+
+def test_expired_cooldowns_are_pruned():
+    engine = KeywordEngine([KeywordRule("cat", ["кот"], "мяу", cooldown=10)])
+    for chat_id in range(100):
+        engine.match(str(chat_id), "кот", now=0.0)
+    assert len(engine._cooldown_until) == 100
+    engine.match("x", "ничего", now=KeywordEngine.PRUNE_INTERVAL)
+    assert engine._cooldown_until == {}
+
+
+def test_rule_limited_to_chats():
+    engine = KeywordEngine([KeywordRule("cat", ["кот"], "мяу", chats=[-100])])
+    assert ids(engine.match("-100", "кот")) == ["cat"]
+    assert ids(engine.match("-200", "кот")) == []
+
+
+def test_reload_if_changed(tmp_path):
+    path = tmp_path / "keywords.json"
+    path.write_text(json.dumps({"rules": [{"id": "cat", "keywords": ["кот"], "response": "мяу"}]}))
+    engine = KeywordEngine()
+    engine.load(str(path))
+    assert not engine.reload_if_changed()
+
+    path.write_text(json.dumps({"rules": [{"id": "dog", "keywords": ["пёс"], "response": "гав"}]}))
+    engine._mtime = None
+    assert engine.reload_if_changed()
+    assert ids(engine.match("1", "кот и пес")) == ["dog"]
+
+    # Битый файл не ломает уже загруженные правила
+    path.write_text("{")
+    engine._mtime = None
+    assert not engine.reload_if_changed()
+    assert ids(engine.match("1", "пес")) == ["dog"]
@@ -0,0 +1,36 @@
+from mentions import MESSAGE_LIMIT, NAME_LIMIT, build_mention_chunks, format_mention, utf16_length
+
+
+def test_format_mention_escapes_and_truncates_name():
+    assert format_mention(1, "<b>&") == '<a href="tg://user?id=1">&lt;b&gt;&amp;</a>'
+    assert format_mention(1, "x" * 100) == f'<a href="tg://user?id=1">{"x" * NAME_LIMIT}</a>'
+
+
+def test_utf16_length_counts_surrogate_pairs():
+    assert utf16_length("abc") == 3
+    assert utf16_length("😀") == 2
+
+
+def test_chunks_limited_by_mention_count():
+    members = [(user_id, f"user{user_id}") for user_id in range(120)]
+    chunks = build_mention_chunks(members, max_mentions=50)
+    assert [chunk.count("<a ") for chunk in chunks] == [50, 50, 20]
+
+
+def test_chunks_limited_by_utf16_length():
+    # Эмодзи — два символа UTF-16: длина считается так же, как у Telegram
+    members = [(user_id, "😀" * NAME_LIMIT) for user_id in range(200)]
+    chunks = build_mention_chunks(members, max_mentions=1000)
+    assert len(chunks) > 1
+    assert all(utf16_length(chunk) <= MESSAGE_LIMIT for chunk in chunks)
+    assert sum(chunk.count("<a ") for chunk in chunks) == 200
+
+
+def test_chunks_keep_member_order():
+    members = [(user_id, str(user_id)) for user_id in range(10)]
+    chunks = build_mention_chunks(members, max_mentions=3)
+    assert " ".join(chunks) == " ".join(format_mention(user_id, name) for user_id, name in members)
+
+
+def test_no_members_no_chunks():
+    assert build_mention_chunks([]) == []
@@ -0,0 +1,113 @@
+import asyncio
+from types import SimpleNamespace
+
+from ratelimit import Limit, RateLimiter
+
+
+def make_update(chat_id=1, user_id=10):
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=chat_id),
+        effective_user=SimpleNamespace(id=user_id),
+        effective_message=SimpleNamespace(chat_id=chat_id, from_user_id=user_id),
+    )
+
+
+def test_acquire_spends_burst_then_waits_for_refill():
+    limiter = RateLimiter()
+    limit = Limit(2, 10)
+    checks = [(("cmd",), limit)]
+    assert limiter.acquire(checks, now=0.0) == (0.0, None)
+    assert limiter.acquire(checks, now=0.0) == (0.0, None)
+    wait, bucket = limiter.acquire(checks, now=0.0)
+    assert wait == 5.0 and bucket is not None
+    # За 5 секунд восстанавливается один токен
+    assert limiter.acquire(checks, now=5.0) == (0.0, None)
+
+
+def test_blocked_check_spends_no_tokens_from_other_buckets():
+    limiter = RateLimiter()
+    user, chat = Limit(1, 10), Limit(5, 10)
+    assert limiter.acquire([(("u",), user), (("c",), chat)], now=0.0)[1] is None
+    assert limiter.acquire([(("u",), user), (("c",), chat)], now=0.0)[1] is not None
+    assert limiter._buckets[("c",)].tokens == 4
+
+
+def test_sweep_drops_full_buckets():
+    limiter = RateLimiter(sweep_interval=60.0)
+    limiter._last_sweep = 0.0
+    limiter.acquire([(("a",), Limit(1, 10))], now=0.0)
+    assert limiter.size == 1
+    limiter.acquire([(("b",), Limit(1, 1000))], now=60.0)
+    assert limiter.size == 1 and ("b",) in limiter._buckets
+
+
+def test_limit_rejects_and_warns_once():
+    notes = []
+
+    async def notify(message, text):
+        notes.append(text)
+
+    async def handler(update, context):
+        return "ok"
+
+    async def run():
+        limiter = RateLimiter(notify=notify)
+        wrapped = limiter.limit("cmd", handler, per_user=Limit(1, 60))
+        results = [await wrapped(make_update(), None) for _ in range(3)]
+        return limiter, results
+
+    limiter, results = asyncio.run(run())
+    assert results == ["ok", None, None]
+    assert limiter.rejected == 2
+    assert len(notes) == 1 and notes[0].startswith("Слишком часто")
+
+
+def test_limit_merges_concurrent_duplicates_and_answers_them():
+    notes = []
+    calls = []
+
+    async def notify(message, text):
+        notes.append(text)
+
+    async def handler(update, context):
+        calls.append(update)
+        await asyncio.sleep(0.01)
+        return SimpleNamespace(text="список")
+
+    async def run():
+        limiter = RateLimiter(notify=notify)
+        wrapped = limiter.limit("cmd", handler, per_chat=Limit(10, 60), debounce=5)
+        results = await asyncio.gather(*(wrapped(make_update(user_id=user_id), None) for user_id in range(3)))
+        return limiter, results
+
+    limiter, results = asyncio.run(run())
+    assert len(calls) == 1
+    assert limiter.merged == 2
+    assert [result.text for result in results] == ["список"] * 3
+    assert notes == ["список", "список"]
+
+
+def test_limit_duplicate_without_text_gets_note():
+    notes = []
+
+    async def notify(message, text):
+        notes.append(text)
+
+    async def handler(update, context):
+        return None
+
+    async def run():
+        limiter = RateLimiter(notify=notify)
+        wrapped = limiter.limit("cmd", handler, per_chat=Limit(10, 60), debounce=5)
+        await wrapped(make_update(), None)
+        await wrapped(make_update(), None)
+
+    asyncio.run(run())
+    assert notes == [RateLimiter.DUPLICATE_NOTE]
+
+
+def test_disabled_limiter_returns_handler_unchanged():
+    async def handler(update, context):
+        return None
+
+    assert RateLimiter(enabled=False).limit("cmd", handler, total=Limit(1, 1)) is handler
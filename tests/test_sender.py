@@ -0,0 +1,166 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from sender import BULK, EDITS, INTERACTIVE, OutboundScheduler
+
+
+class FakeBot:
+    """Записывает вызовы; failures — сколько первых вызовов ответят 429 с паузой retry_after."""
+
+    def __init__(self, delay=0.0, failures=0, retry_after=0.05):
+        self.delay = delay
+        self.failures = failures
+        self.retry_after = retry_after
+        self.calls = []
+
+    async def _call(self, method, kwargs):
+        self.calls.append((method, kwargs, time.monotonic()))
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise RetryAfter(self.retry_after)
+        return (method, kwargs.get("text"))
+
+    async def send_message(self, **kwargs):
+        return await self._call("send_message", kwargs)
+
+    async def edit_message_text(self, **kwargs):
+        return await self._call("edit_message_text", kwargs)
+
+
+def scheduler(**kwargs):
+    kwargs.setdefault("intervals", (0.0, 0.0, 0.0))
+    kwargs.setdefault("global_rate", 1000.0)
+    return OutboundScheduler(**kwargs)
+
+
+def test_lanes_go_in_priority_order():
+    bot = FakeBot()
+
+    async def run():
+        outbox = scheduler()
+        await outbox.send(bot, 1, "bulk", lane=BULK, wait=False)
+        await outbox.edit(bot, 2, 10, "edit", wait=False)
+        await outbox.send(bot, 3, "reply", lane=INTERACTIVE, wait=False)
+        await outbox.start()
+        await outbox.stop()
+
+    asyncio.run(run())
+    assert [kwargs["text"] for _, kwargs, _ in bot.calls] == ["reply", "edit", "bulk"]
+
+
+def test_pending_edits_of_one_message_are_coalesced():
+    bot = FakeBot(delay=0.05)
+
+    async def run():
+        outbox = scheduler()
+        await outbox.start()
+        # Первая правка уходит сразу, следующие ждут, пока чат занят, и сливаются в одну
+        first = asyncio.ensure_future(outbox.edit(bot, 1, 10, "v1"))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.ensure_future(outbox.edit(bot, 1, 10, f"v{n}")) for n in range(2, 5)]
+        results = await asyncio.gather(first, *waiters)
+        await outbox.stop()
+        return outbox, results
+
+    outbox, results = asyncio.run(run())
+    assert [kwargs["text"] for _, kwargs, _ in bot.calls] == ["v1", "v4"]
+    assert results == [("edit_message_text", "v1")] + [("edit_message_text", "v4")] * 3
+    assert outbox.coalesced == 2 and outbox.sent == 2
+
+
+def test_retry_after_requeues_and_pauses_chat():
+    bot = FakeBot(failures=1, retry_after=0.1)
+
+    async def run():
+        outbox = scheduler()
+        await outbox.start()
+        result = await outbox.send(bot, 1, "hi")
+        await outbox.stop()
+        return result
+
+    assert asyncio.run(run()) == ("send_message", "hi")
+    assert len(bot.calls) == 2
+    assert bot.calls[1][2] - bot.calls[0][2] >= 0.1
+
+
+def test_retry_after_hands_waiters_to_newer_edit():
+    bot = FakeBot(delay=0.05, failures=1, retry_after=0.05)
+
+    async def run():
+        outbox = scheduler()
+        await outbox.start()
+        old = asyncio.ensure_future(outbox.edit(bot, 1, 10, "old"))
+        await asyncio.sleep(0.01)
+        # Старая правка уже отправляется и получит 429 — новая заменит её
+        new = asyncio.ensure_future(outbox.edit(bot, 1, 10, "new"))
+        results = await asyncio.gather(old, new)
+        await outbox.stop()
+        return results
+
+    assert asyncio.run(run()) == [("edit_message_text", "new")] * 2
+    assert [kwargs["text"] for _, kwargs, _ in bot.calls] == ["old", "new"]
+
+
+def test_gives_up_after_max_retries():
+    bot = FakeBot(failures=10, retry_after=0.01)
+
+    async def run():
+        outbox = scheduler(max_retries=2)
+        await outbox.start()
+        try:
+            with pytest.raises(RetryAfter):
+                await outbox.send(bot, 1, "hi")
+        finally:
+            await outbox.stop()
+
+    asyncio.run(run())
+    assert len(bot.calls) == 3
+
+
+def test_chat_interval_between_requests_of_one_lane():
+    bot = FakeBot()
+
+    async def run():
+        outbox = scheduler(intervals=(0.0, 0.1, 0.0))
+        await outbox.start()
+        await outbox.edit(bot, 1, 10, "a")
+        await outbox.edit(bot, 1, 11, "b")
+        await outbox.stop()
+
+    asyncio.run(run())
+    assert bot.calls[1][2] - bot.calls[0][2] >= 0.1
+
+
+def test_stop_waits_for_queued_and_running_requests():
+    bot = FakeBot(delay=0.05)
+
+    async def run():
+        outbox = scheduler()
+        await outbox.start()
+        for n in range(3):
+            await outbox.send(bot, 1, str(n), wait=False)
+        await outbox.stop(timeout=5)
+        return outbox
+
+    outbox = asyncio.run(run())
+    assert outbox.sent == 3 and outbox.depth == 0 and not outbox._running
+
+
+def test_stop_cancels_requests_still_running_after_timeout():
+    bot = FakeBot(delay=10)
+
+    async def run():
+        outbox = scheduler()
+        await outbox.start()
+        waiter = asyncio.ensure_future(outbox.send(bot, 1, "slow"))
+        await asyncio.sleep(0.01)
+        await outbox.stop(timeout=0.05)
+        await asyncio.sleep(0)
+        return outbox, waiter
+
+    outbox, waiter = asyncio.run(run())
+    assert waiter.cancelled() and not outbox._running
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import threading
+
+from persistence import WriteBehind, atomic_write_json
+from registry import MemberRegistry
+from storage import JsonStorage, SqliteStorage
+
+
+def open_pair(tmp_path):
+    path = str(tmp_path / "bot.db")
+    bot, worker = SqliteStorage(path), SqliteStorage(path)
+    bot.writer, worker.writer = "bot", "worker"
+    return bot, worker
+
+
+def test_changes_since_reports_other_writers_only(tmp_path):
+    bot, worker = open_pair(tmp_path)
+    seq = bot.changes_since(None)[0]
+    bot.write(([("-1", 1, "-1", "A", "", 0)], []))
+    worker.set_names("-1", {1: "Alice"})
+    worker.write(([("-2", 2, "-2", "B", "", 0)], []))
+    last, chat_ids = bot.changes_since(seq)
+    assert sorted(chat_ids) == ["-1", "-2"]
+    assert worker.changes_since(seq)[1] == ["-1"]
+    assert bot.changes_since(last) == (last, [])
+    assert bot.load_chat("-1")[0]["first_name"] == "Alice"
+
+
+def test_changes_since_after_trimmed_log(tmp_path):
+    bot, worker = open_pair(tmp_path)
+    worker.CHANGES_KEEP = 2
+    for user_id in range(5):
+        worker.write(([("-1", user_id, "-1", None, "", 0)], []))
+    assert bot.changes_since(0)[1] is None
+
+
+def test_refresh_keeps_unsaved_local_members(tmp_path):
+    bot, worker = open_pair(tmp_path)
+    registry = MemberRegistry(loader=bot.load_chat)
+    registry.add("-1", 1)
+    registry.add("-1", 2, "B")
+    bot.write(bot.snapshot(registry, {("-1", 1), ("-1", 2)}))
+    member = registry.get("-1", 1)
+    registry.get("-1", 2).nickname = "local"
+    worker.set_names("-1", {1: "Alice", 2: "Bob"})
+
+    registry.refresh("-1", bot.load_chat("-1"), keep={2})
+    assert registry.get("-1", 1) is member and member.first_name == "Alice"
+    assert registry.get("-1", 2).first_name == "B" and registry.get("-1", 2).nickname == "local"
+
+
+def test_json_flush_during_preload_keeps_chat(tmp_path):
+    path = str(tmp_path / "active_users.json")
+    atomic_write_json(path, {
+        "-1": [{"id": 1, "first_name": "A"}],
+        "-2": [{"id": 2, "first_name": "B"}],
+        "-3": [{"id": 3, "first_name": "C"}],
+    })
+    storage = JsonStorage(path)
+    loading = threading.Event()
+    resume = threading.Event()
+
+    # Чтение чата -1 в потоке останавливается, пока идёт запись
+    def loader(chat_id):
+        items = storage.load_chat(chat_id)
+        if chat_id == "-1":
+            loading.set()
+            resume.wait(5)
+        return items
+
+    registry = MemberRegistry(loader=loader)
+    persistence = WriteBehind(lambda keys: storage.snapshot(registry, keys), storage.write)
+
+    async def run():
+        await registry.preload("-2")
+        registry.remove("-2", 2)
+        persistence.mark_dirty(("-2", 2))
+        preload = asyncio.create_task(registry.preload("-1"))
+        await asyncio.to_thread(loading.wait, 5)
+        await persistence.flush()
+        resume.set()
+        await preload
+
+    asyncio.run(run())
+    with open(path) as file:
+        data = json.load(file)
+    # Опустевший в реестре чат -2 удалён, а загружавшийся -1 и незагруженный -3 на месте
+    assert sorted(data) == ["-1", "-3"]
+    assert registry.get("-1", 1).first_name == "A"
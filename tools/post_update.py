@@ -0,0 +1,109 @@
+"""
+Локальный «Telegram»: отправляет синтетические обновления в вебхук бота.
+
+Пример:
+    RUN_MODE=webhook WEBHOOK_SECRET=secret python bot/main.py
+    python tools/post_update.py --secret secret --text "/roll 1-6"
+    python tools/post_update.py --secret secret --text "майнкрафт" --count 100
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+import aiohttp
+
+_update_ids = itertools.count(int(time.time()))
+_message_ids = itertools.count(1)
+
+
+# Обновление с текстовым сообщением в формате Bot API
+def make_text_update(text, chat_id=-100, user_id=1, first_name="Tester", date=None) -> dict:
+    entities = []
+    if text.startswith("/"):
+        command = text.split()[0]
+        entities.append({"type": "bot_command", "offset": 0, "length": len(command)})
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(date if date is not None else time.time()),
+        "chat": {"id": chat_id, "type": "supergroup", "title": "Test chat"},
+        "from": {"id": user_id, "is_bot": False, "first_name": first_name},
+        "text": text,
+    }
+    if entities:
+        message["entities"] = entities
+    return {"update_id": next(_update_ids), "message": message}
+
+
+# Голосовое сообщение; file_id ведёт на файл, который отдаёт тестовый Bot API
+def make_voice_update(file_id, chat_id=-100, user_id=1, first_name="Tester", duration=3, date=None) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(date if date is not None else time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "Test chat"},
+            "from": {"id": user_id, "is_bot": False, "first_name": first_name},
+            "voice": {"file_id": file_id, "file_unique_id": file_id, "duration": duration,
+                      "mime_type": "audio/ogg"},
+        },
+    }
+
+
+# Нажатие инлайн-кнопки под сообщением бота message_id
+def make_callback_update(data, message_id, chat_id=-100, user_id=1, first_name="Tester") -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": first_name},
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": "Test chat"},
+                "from": {"id": 42, "is_bot": True, "first_name": "Bot"},
+                "text": "Оно тебе надо?",
+            },
+        },
+    }
+
+
+async def post_updates(url, updates, secret=None, concurrency=10) -> list:
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession() as session:
+        async def post(update):
+            async with semaphore:
+                async with session.post(url, data=json.dumps(update), headers=headers) as response:
+                    return response.status
+
+        return await asyncio.gather(*(post(update) for update in updates))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret")
+    parser.add_argument("--text", default="/roll")
+    parser.add_argument("--chat-id", type=int, default=-100)
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--count", type=int, default=1)
+    args = parser.parse_args()
+
+    updates = [
+        make_text_update(args.text, chat_id=args.chat_id, user_id=args.user_id)
+        for _ in range(args.count)
+    ]
+    statuses = asyncio.run(post_updates(args.url, updates, secret=args.secret))
+    summary = {status: statuses.count(status) for status in set(statuses)}
+    print(json.dumps({"sent": len(statuses), "statuses": summary}))
+
+
+if __name__ == "__main__":
+    main()